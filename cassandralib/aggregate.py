@@ -0,0 +1,171 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from cassandralib.schema import to_float
+
+AGGREGATES = ('count', 'sum', 'min', 'max', 'mean')
+
+# Running totals kept per period, from which every aggregate follows.
+PARTIALS = ('count', 'sum', 'min', 'max')
+
+
+def nanoseconds(index):
+    """Return a DatetimeIndex as int64 nanoseconds since epoch (UTC)."""
+    return np.asarray(index.values, dtype='datetime64[ns]').view(np.int64)
+
+
+def combine(partials):
+    """Combine partial aggregates of overlapping periods."""
+    df = pd.concat(partials)
+    if not df.index.has_duplicates:
+        return df
+    grouped = df.groupby(level=0)
+    sums = grouped.sum()
+    return pd.concat({
+        'count': sums['count'],
+        'sum': sums['sum'],
+        'min': grouped.min()['min'],
+        'max': grouped.max()['max'],
+    }, axis=1)
+
+
+class Aggregator(object):
+    """Fold DataFrames into per-period aggregates as they arrive.
+
+    ``resample`` is a fixed frequency, like '15min', 'H' or 'D'. Frames
+    must be passed to add() in time order; it returns the aggregates of
+    the periods that are complete, while the last period is carried over
+    to the next frame (or to finish()). Only running count, sum, min and
+    max are kept, never the frames themselves.
+
+    Every column in ``keys`` (if None, all columns except the 'flag') is
+    converted to float and aggregated. If there's a single aggregate, the
+    result has one column per key; otherwise the columns are a (key,
+    aggregate) MultiIndex.
+
+    """
+
+    def __init__(self, resample, aggregate=('mean',), keys=None):
+        if not isinstance(aggregate, (list, tuple)):
+            aggregate = (aggregate,)
+        for name in aggregate:
+            assert name in AGGREGATES, "Unknown aggregate: %s" % name
+        self.freq = pd.tseries.frequencies.to_offset(resample).nanos
+        self.aggregate = tuple(aggregate)
+        self.keys = keys
+        self.carry = None
+
+    def partial(self, df):
+        """Return the partial aggregates (count, sum, min and max per key,
+        indexed by period start in ns) of the periods of a frame."""
+        if self.keys is None:
+            keys = [key for key in df.columns if key != 'flag']
+        else:
+            keys = [key for key in df.columns if key in self.keys]
+        numeric = pd.DataFrame(
+            dict((key, to_float(df[key].values)) for key in keys),
+            index=df.index
+        )
+        stamps = nanoseconds(df.index)
+        grouped = numeric.groupby(stamps - stamps % self.freq)
+        return pd.concat({
+            'count': grouped.count(),
+            'sum': grouped.sum(),
+            'min': grouped.min(),
+            'max': grouped.max(),
+        }, axis=1)
+
+    def add(self, df):
+        if len(df) == 0:
+            return self._result(None)
+        return self._fold(self.partial(df))
+
+    def add_partial(self, partial):
+        """Like add(), for partial aggregates (count, sum, min and max per
+        key, indexed by period start in ns) of a finer resolution that
+        divides this one, such as those stored in a rollup."""
+        if len(partial) == 0:
+            return self._result(None)
+        stamps = np.asarray(partial.index, dtype=np.int64)
+        partial = partial.copy()
+        partial.index = stamps - stamps % self.freq
+        return self._fold(combine([partial]))
+
+    def _fold(self, partial):
+        if self.carry is not None:
+            partial = combine([self.carry, partial])
+        self.carry = partial.iloc[-1:]
+        return self._result(partial.iloc[:-1])
+
+    def finish(self):
+        carry, self.carry = self.carry, None
+        return self._result(carry)
+
+    def _result(self, partial):
+        if partial is None or len(partial) == 0:
+            return pd.DataFrame()
+        count = partial['count']
+        results = {}
+        for name in self.aggregate:
+            if name == 'mean':
+                results[name] = partial['sum'] / count.where(count > 0)
+            else:
+                results[name] = partial[name]
+        index = pd.DatetimeIndex(np.asarray(partial.index, dtype='M8[ns]'))
+        if len(self.aggregate) == 1:
+            result = results[self.aggregate[0]]
+        else:
+            result = pd.concat(results, axis=1).swaplevel(0, 1, axis=1)
+            result = result.sort_index(axis=1)
+        result.index = index.tz_localize(pytz.UTC)
+        return result
+
+
+class Rollup(object):
+    """Per-period aggregates of a column family, kept in another one.
+
+    The rollup column family holds the count, sum, min and max of every
+    key (except 'flag') for each period of ``resample``, stored like raw
+    data: one column per period start and '<key>_<aggregate>'.
+
+    """
+
+    def __init__(self, column_family, resample, ignore_rejected=False):
+        self.column_family = column_family
+        self.resample = resample
+        self.freq = pd.tseries.frequencies.to_offset(resample).nanos
+        self.ignore_rejected = bool(ignore_rejected)
+
+    def to_columns(self, df):
+        """Flatten (key, aggregate) columns to '<key>_<aggregate>'."""
+        result = df.copy()
+        result.columns = ['%s_%s' % (key, name) for key, name in df.columns]
+        return result
+
+    def from_partial(self, partial):
+        """Return partial aggregates as '<key>_<aggregate>' columns, to
+        write."""
+        index = pd.DatetimeIndex(np.asarray(partial.index, dtype='M8[ns]'))
+        return pd.DataFrame(
+            dict(('%s_%s' % (key, name), partial[(name, key)].values)
+                 for name, key in partial.columns),
+            index=index.tz_localize(pytz.UTC)
+        )
+
+    def from_columns(self, df, keys=None):
+        """Turn '<key>_<aggregate>' columns back into partial aggregates."""
+        columns = {}
+        for column in df.columns:
+            key, name = column.rsplit('_', 1)
+            if name in PARTIALS and (keys is None or key in keys):
+                columns[(name, key)] = to_float(df[column].values)
+        if not columns:
+            return pd.DataFrame()
+        partial = pd.DataFrame(columns, index=nanoseconds(df.index))
+        partial.columns = pd.MultiIndex.from_tuples(partial.columns)
+        return partial
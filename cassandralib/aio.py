@@ -0,0 +1,78 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+"""asyncio interface to CassandraDataStore (Python 3 only)."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from cassandralib.models import CassandraDataStore
+
+
+class AsyncCassandraDataStore(object):
+    """Run the blocking CassandraDataStore calls off the event loop.
+
+    Reads run on a thread pool with one thread per pool connection, and
+    at most ``max_concurrency`` requests are in flight at once (by default
+    as many as there are connections). Writes and commits share a single
+    thread, because the store buffers mutations per thread. Cancelling a
+    call that hasn't started yet keeps it from running at all; a call
+    that is already running finishes, but its result is dropped.
+
+    Arguments other than ``max_concurrency`` are passed on to
+    CassandraDataStore.
+
+    """
+
+    def __init__(self, nodes, keyspace, queue_size, max_concurrency=None,
+                 **kwargs):
+        self.store = CassandraDataStore(nodes, keyspace, queue_size,
+                                        **kwargs)
+        connections = self.store.pool_size + max(self.store.max_overflow, 0)
+        if max_concurrency is None:
+            max_concurrency = connections
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=connections, thread_name_prefix='cassandralib-read'
+        )
+        self._write_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='cassandralib-write'
+        )
+
+    async def _run(self, executor, func, *args, **kwargs):
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                executor, functools.partial(func, *args, **kwargs)
+            )
+
+    async def read(self, *args, **kwargs):
+        return await self._run(self._read_executor, self.store.read,
+                               *args, **kwargs)
+
+    async def read_many(self, *args, **kwargs):
+        return await self._run(self._read_executor, self.store.read_many,
+                               *args, **kwargs)
+
+    async def write_row(self, *args, **kwargs):
+        return await self._run(self._write_executor, self.store.write_row,
+                               *args, **kwargs)
+
+    async def write_frame(self, *args, **kwargs):
+        return await self._run(self._write_executor, self.store.write_frame,
+                               *args, **kwargs)
+
+    async def commit(self, column_family):
+        return await self._run(self._write_executor, self.store.commit,
+                               column_family)
+
+    async def close(self):
+        """Send pending writes and stop the executors."""
+        await self._run(self._write_executor, self.store.commit_all)
+        self._read_executor.shutdown(wait=False)
+        self._write_executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,196 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import gc
+import time
+
+import numpy as np
+import pandas as pd
+import pytz
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2: no peak memory.
+    tracemalloc = None
+
+from cassandralib import fake
+from cassandralib.filters import REJECTED
+
+# Columns per bucket row.
+SIZES = (1000, 10000, 100000, 1000000, 10000000)
+KEY_COUNTS = (1, 2, 5, 10)
+CONVERSIONS = (None, 'float', 'integer')
+REJECTED_RATIOS = (0, 0.1, 0.5, 0.9)
+BATCH_SIZES = (100, 1000, 10000)
+
+START = pd.Timestamp('2013-01-01', tz=pytz.UTC)
+SENSOR_ID = 'benchmark'
+
+
+def frame(columns, keys=2, rejected=0, seed=0):
+    """Return a DataFrame of about ``columns`` columns in ``keys`` keys.
+
+    The timestamps are a second apart, so up to 31M of them fit in one
+    (yearly) bucket. One key is the 'flag', of which a fraction of
+    ``rejected`` is rejected; the others are random floats.
+
+    """
+    random = np.random.RandomState(seed)
+    length = max(columns // keys, 1)
+    index = pd.date_range(START, periods=length, freq='s')
+    data = {'value': random.random_sample(length).round(3)}
+    for i in range(1, keys - 1):
+        data['key%d' % i] = random.random_sample(length).round(3)
+    if keys > 1:
+        data['flag'] = np.where(random.random_sample(length) < rejected,
+                                REJECTED, '0')
+    return pd.DataFrame(data, index=index)
+
+
+def store(queue_size=1000):
+    """Return an empty FakeDataStore."""
+    fake.clear()
+    return fake.FakeDataStore([], 'benchmark', queue_size)
+
+
+def measure(function, repeat=3):
+    """Call function repeat times and return its timings and peak memory.
+
+    The timings don't include the call under tracemalloc, which is made
+    separately since tracing slows allocations down.
+
+    """
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        timer_start = time.time()
+        function()
+        timings.append(time.time() - timer_start)
+    peak = None
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return {
+        'median': float(np.median(timings)),
+        'min': min(timings),
+        'max': max(timings),
+        'peak': peak,
+    }
+
+
+def _read(columns, keys=2, rejected=0, convert_values_to=None,
+          ignore_rejected=None):
+    datastore = store()
+    datastore.write_frame('benchmark', SENSOR_ID,
+                          frame(columns, keys, rejected))
+    datastore.commit('benchmark')
+    end = START + pd.Timedelta(days=365)
+
+    def read():
+        datastore.read('benchmark', SENSOR_ID, START.to_pydatetime(),
+                       end.to_pydatetime(),
+                       convert_values_to=convert_values_to,
+                       ignore_rejected=ignore_rejected)
+    return read
+
+
+def _write_row(columns, queue_size):
+    df = frame(columns)
+    rows = [(timestamp.to_pydatetime(), row) for timestamp, row in
+            zip(df.index, df.to_dict('records'))]
+
+    def write():
+        datastore = store(queue_size)
+        for timestamp, row in rows:
+            datastore.write_row('benchmark', SENSOR_ID, timestamp, row)
+        datastore.commit('benchmark')
+    return write
+
+
+def _write_frame(columns, chunk_size):
+    df = frame(columns)
+
+    def write():
+        datastore = store()
+        datastore.write_frame('benchmark', SENSOR_ID, df, chunk_size)
+        datastore.commit('benchmark')
+    return write
+
+
+def benchmarks(sizes=SIZES[:4], size=100000, write_size=100000):
+    """Yield (name, parameters, columns, function) of every benchmark.
+
+    Read benchmarks vary one parameter at a time: the columns per bucket
+    (``sizes``), and with ``size`` columns the number of keys, the
+    conversion and the fraction of rejected values. Write benchmarks
+    write ``write_size`` columns with different batch sizes.
+
+    """
+    for columns in sizes:
+        yield 'read', 'columns=%d' % columns, columns, \
+            _read(columns)
+    for keys in KEY_COUNTS:
+        yield 'read', 'keys=%d' % keys, size, _read(size, keys=keys)
+    for convert_values_to in CONVERSIONS:
+        yield 'read', 'convert_values_to=%s' % convert_values_to, size, \
+            _read(size, convert_values_to=convert_values_to)
+    for rejected in REJECTED_RATIOS:
+        yield 'read', 'ignore_rejected, rejected=%s' % rejected, size, \
+            _read(size, rejected=rejected, ignore_rejected=True)
+    for batch_size in BATCH_SIZES:
+        yield 'write_row', 'queue_size=%d' % batch_size, write_size, \
+            _write_row(write_size, batch_size)
+        yield 'write_frame', 'chunk_size=%d' % batch_size, write_size, \
+            _write_frame(write_size, batch_size)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark cassandralib.models on an in-memory "
+        "stand-in for Cassandra.")
+    parser.add_argument(
+        '--sizes', default=','.join('%d' % size for size in SIZES[:4]),
+        help="columns per bucket for the read benchmarks, comma "
+        "separated (up to %d, default: %%(default)s)" % SIZES[-1])
+    parser.add_argument(
+        '--size', type=int, default=100000,
+        help="columns for the other read benchmarks (default: "
+        "%(default)s)")
+    parser.add_argument(
+        '--write-size', type=int, default=100000,
+        help="columns for the write benchmarks (default: %(default)s)")
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help="timed calls per benchmark (default: %(default)s)")
+    parser.add_argument(
+        '--only', help="only run benchmarks with this name (read, "
+        "write_row or write_frame)")
+    options = parser.parse_args(args)
+
+    sizes = [int(size) for size in options.sizes.split(',')]
+    print('%-12s %-32s %10s %10s %10s %14s %10s' % (
+        'benchmark', 'parameters', 'columns', 'median ms', 'max ms',
+        'columns/s', 'peak MB'))
+    for name, parameters, columns, function in benchmarks(
+            sizes, options.size, options.write_size):
+        if options.only and name != options.only:
+            continue
+        result = measure(function, options.repeat)
+        peak = '-' if result['peak'] is None else \
+            '%.1f' % (result['peak'] / 1e6)
+        print('%-12s %-32s %10d %10.1f %10.1f %14.0f %10s' % (
+            name, parameters, columns, result['median'] * 1e3,
+            result['max'] * 1e3, columns / result['median'], peak))
+
+
+if __name__ == '__main__':
+    main()
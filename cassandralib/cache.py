@@ -0,0 +1,241 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+from cassandralib.models import CLOSED_AFTER
+from cassandralib.models import COLNAME_SEPERATOR
+
+logger = logging.getLogger(__name__)
+
+
+class BucketCache(object):
+    """In-memory LRU cache of the columns of closed buckets.
+
+    Buckets for past periods don't change anymore, so there's no need to
+    fetch them from Cassandra on every read. An entry holds all columns
+    of one bucket row as two numpy arrays (sorted names and values), which
+    are empty for a bucket without data. The cache is bounded by
+    ``max_bytes``; the least recently used entries are evicted first. If
+    a ``directory`` is given, evicted entries are written there as .npz
+    files and loaded again on a later miss.
+
+    A bucket counts as closed once ``closed_after`` has passed since its
+    end; until then it is always read from Cassandra.
+
+    """
+
+    def __init__(self, max_bytes, directory=None,
+                 closed_after=CLOSED_AFTER):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.closed_after = closed_after
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, column_family, rowkey):
+        digest = hashlib.md5(
+            ('%s/%s' % (column_family, rowkey)).encode('utf-8')
+        ).hexdigest()
+        return os.path.join(self.directory, digest + '.npz')
+
+    def get(self, column_family, rowkey):
+        """Return (names, values) of a bucket row, or None on a miss."""
+        key = (column_family, rowkey)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[:2]
+        if self.directory is not None:
+            try:
+                data = np.load(self._path(column_family, rowkey),
+                               allow_pickle=True)
+            except (IOError, OSError):
+                # Not spilled, or just removed by invalidate().
+                data = None
+            if data is not None:
+                with data:
+                    entry = self._put(key, data['names'], data['values'])
+                with self._lock:
+                    self.hits += 1
+                return entry
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, column_family, rowkey, names, values):
+        """Cache all columns of a bucket row and return them as arrays.
+
+        Names must be sorted.
+
+        """
+        names = np.asarray(names)
+        array = None
+        if not any(isinstance(value, bytes) for value in values):
+            array = np.asarray(values)
+        if array is None or array.dtype.kind != 'U':
+            # Binary values may end with NUL bytes, which numpy strips
+            # from fixed width strings, and would become text in a
+            # bucket that also has text values.
+            array = np.empty(len(values), dtype=object)
+            array[:] = list(values)
+        return self._put((column_family, rowkey), names, array)
+
+    def _put(self, key, names, values):
+        size = names.nbytes + values.nbytes
+        if values.dtype == object:
+            size += sum(map(len, values))
+        entry = (names, values, size)
+        if size > self.max_bytes:
+            self._spill([(key, entry)])
+            return names, values
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._entries[key] = entry
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                old_key, old = self._entries.popitem(last=False)
+                self.nbytes -= old[2]
+                self.evictions += 1
+                evicted.append((old_key, old))
+        self._spill(evicted)
+        return names, values
+
+    def _spill(self, entries):
+        if self.directory is None:
+            return
+        for (column_family, rowkey), (names, values, size) in entries:
+            path = self._path(column_family, rowkey)
+            if not os.path.exists(path):
+                np.savez(path, names=names, values=values)
+
+    def invalidate(self, column_family, rowkey):
+        """Forget a bucket row, e.g. because it was written to."""
+        with self._lock:
+            old = self._entries.pop((column_family, rowkey), None)
+            if old is not None:
+                self.nbytes -= old[2]
+        if self.directory is not None:
+            try:
+                os.remove(self._path(column_family, rowkey))
+            except OSError:
+                # Not spilled, or removed by another thread.
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        if self.directory is not None:
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, filename))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+            }
+
+
+class LatestCache(object):
+    """The columns of the last timestamps of sensors.
+
+    Entries are filled by CassandraDataStore.read_latest() and kept
+    current by the writes of the store, so the latest values are served
+    without asking Cassandra. An entry holds every timestamp from its
+    oldest one on, so it answers for any ``n`` up to the number it was
+    filled with. Writes made by other processes aren't seen.
+
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Rows (columns by name) by stamp, and the number of stamps to
+        # keep, by column family and sensor.
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def size(self, column_family, sensor_id):
+        """Return the number of stamps kept for a sensor (0 if none)."""
+        entry = self._entries.get((column_family, sensor_id))
+        return 0 if entry is None else entry[1]
+
+    def get(self, column_family, sensor_id, n, until):
+        """Return (names, values) of the last ``n`` stamps before
+        ``until``, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get((column_family, sensor_id))
+            stamps = [] if entry is None else \
+                [stamp for stamp in entry[0] if stamp < until]
+            if len(stamps) < n:
+                self.misses += 1
+                return None
+            self.hits += 1
+            names, values = [], []
+            for stamp in sorted(stamps)[-n:]:
+                row = entry[0][stamp]
+                names.extend(row)
+                values.extend(row.values())
+            return names, values
+
+    def put(self, column_family, sensor_id, n, names, values):
+        """Cache the columns of the last ``n`` stamps of a sensor."""
+        rows = {}
+        for name, value in zip(names, values):
+            stamp = name.split(COLNAME_SEPERATOR, 1)[0]
+            rows.setdefault(stamp, {})[name] = value
+        with self._lock:
+            self._entries[(column_family, sensor_id)] = (rows, n)
+
+    def update(self, column_family, sensor_id, names, values):
+        """Add written columns to the entry of a sensor, if any."""
+        key = (column_family, sensor_id)
+        if key not in self._entries:
+            return
+        with self._lock:
+            rows, n = self._entries.get(key, ({}, 0))
+            if not rows:
+                return
+            oldest = min(rows)
+            for name, value in zip(names, values):
+                stamp = name.split(COLNAME_SEPERATOR, 1)[0]
+                if stamp >= oldest:
+                    rows.setdefault(stamp, {})[name] = value
+            for stamp in sorted(rows)[:-n]:
+                del rows[stamp]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+            }
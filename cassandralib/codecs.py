@@ -0,0 +1,85 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import numpy as np
+import pandas as pd
+
+from cassandralib.schema import to_float
+
+# Binary values start with a NUL byte, which text values never do.
+MAGIC = b'\x00'
+
+
+class BinaryCodec(object):
+    """Store values as fixed-width little-endian numbers.
+
+    Every encoded value is a NUL byte, the type code (the kind and size
+    of the dtype, like 'f4' or 'i8', the same on every platform) and the
+    packed number, so it can be told apart from values written as text
+    by older versions. decode() handles both; the binary values of a
+    column are decoded at once with np.frombuffer. Missing values (and
+    text that doesn't parse) become ``missing``.
+
+    The column family must be created with BytesType values.
+
+    """
+
+    def __init__(self, dtype, missing=None):
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        if missing is None:
+            missing = np.nan if self.dtype.kind == 'f' else -1
+        self.missing = missing
+        # dtype.str is like '<f4'; its byte order is always little-endian
+        # here.
+        self.header = MAGIC + self.dtype.str[1:].encode('ascii')
+        self.record = np.dtype([('header', 'S%d' % len(self.header)),
+                                ('value', self.dtype)])
+
+    def encode(self, values):
+        """Return a list of encoded values."""
+        records = np.empty(len(values), dtype=self.record)
+        records['header'] = self.header
+        records['value'] = values
+        return records.view('V%d' % self.record.itemsize).tolist()
+
+    def encode_one(self, value):
+        return self.header + np.array(value, dtype=self.dtype).tobytes()
+
+    def decode(self, values):
+        """Return a numpy array from encoded (or text) values."""
+        values = np.asarray(values, dtype=object)
+        result = np.empty(len(values), dtype=self.dtype)
+        result.fill(self.missing)
+
+        present = np.flatnonzero(~pd.isnull(values))
+        items = values[present]
+        lengths = np.fromiter(map(len, items), dtype=np.intp,
+                              count=len(items))
+        # Old text values can have the same length, but only come back
+        # as bytes from a BytesType column family, with another header.
+        binary = lengths == self.record.itemsize
+        binary[binary] = [isinstance(item, bytes) for item in items[binary]]
+        if binary.any():
+            records = np.frombuffer(b''.join(items[binary]),
+                                    dtype=self.record)
+            # Text can have the same length, so check the header too.
+            valid = records['header'] == self.header
+            result[present[binary][valid]] = records['value'][valid]
+            binary[np.flatnonzero(binary)[~valid]] = False
+        if not binary.all():
+            text = present[~binary]
+            result[text] = self._parse(values[text])
+        return result
+
+    def _parse(self, values):
+        parsed = to_float(values)
+        if self.dtype.kind != 'f':
+            parsed[np.isnan(parsed)] = self.missing
+        return parsed.astype(self.dtype)
+
+
+FLOAT32 = BinaryCodec(np.float32)
+FLOAT64 = BinaryCodec(np.float64)
+INT32 = BinaryCodec(np.int32)
+INT64 = BinaryCodec(np.int64)
@@ -0,0 +1,222 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import bisect
+from collections import OrderedDict
+import time
+
+from pycassa.cassandra.ttypes import NotFoundException
+
+from cassandralib.models import CassandraDataStore
+from cassandralib.models import MAX_COLUMNS
+
+# Column families (rows by rowkey) by keyspace, shared by all pools like
+# the data of a cluster.
+keyspaces = {}
+
+
+def clear():
+    """Drop the data of every keyspace."""
+    keyspaces.clear()
+
+
+class _Row(object):
+
+    def __init__(self):
+        self.columns = {}
+        # Write timestamps, only kept once a column is written with an
+        # explicit one.
+        self.timestamps = None
+        self._names = None
+
+    def names(self):
+        # Sorting is deferred to the first read after a write, so that
+        # chunked inserts into a big row stay cheap.
+        if self._names is None:
+            self._names = sorted(self.columns)
+        return self._names
+
+    def update(self, columns, timestamp=None):
+        if timestamp is not None or self.timestamps is not None:
+            # The write with the highest timestamp wins.
+            if timestamp is None:
+                timestamp = int(time.time() * 1e6)
+            if self.timestamps is None:
+                self.timestamps = {}
+            columns = dict(
+                (name, value) for name, value in columns.items()
+                if self.timestamps.get(name, timestamp) <= timestamp
+            )
+            self.timestamps.update((name, timestamp) for name in columns)
+        if self._names is not None and \
+                any(name not in self.columns for name in columns):
+            self._names = None
+        self.columns.update(columns)
+
+    def remove(self, names):
+        for name in names:
+            self.columns.pop(name, None)
+            if self.timestamps is not None:
+                self.timestamps.pop(name, None)
+        self._names = None
+
+    def slice(self, column_start='', column_finish='', column_reversed=False,
+              column_count=MAX_COLUMNS):
+        names = self.names()
+        if column_reversed:
+            # Like Cassandra, start is the high end when reversed.
+            first = bisect.bisect_left(names, column_finish) \
+                if column_finish else 0
+            last = bisect.bisect_right(names, column_start) \
+                if column_start else len(names)
+            selected = names[max(first, last - column_count):last][::-1]
+        else:
+            first = bisect.bisect_left(names, column_start) \
+                if column_start else 0
+            last = bisect.bisect_right(names, column_finish) \
+                if column_finish else len(names)
+            selected = names[first:min(last, first + column_count)]
+        return selected
+
+
+class FakeConnectionPool(object):
+
+    def __init__(self, keyspace, server_list=None, **kwargs):
+        self.keyspace = keyspace
+        self.server_list = server_list
+        self.column_families = keyspaces.setdefault(keyspace, {})
+
+    def dispose(self):
+        pass
+
+
+class FakeMutator(object):
+    """Buffers inserts and removes until send(), like pycassa's
+    CfMutator; sends by itself every ``queue_size`` mutations."""
+
+    def __init__(self, column_family, queue_size=100):
+        self.column_family = column_family
+        self.queue_size = queue_size
+        self._mutations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.send()
+
+    def _add(self, mutation):
+        self._mutations.append(mutation)
+        if len(self._mutations) >= self.queue_size:
+            self.send()
+        return self
+
+    def insert(self, key, columns, timestamp=None, ttl=None):
+        return self._add((self.column_family.insert, key, dict(columns),
+                          timestamp))
+
+    def remove(self, key, columns=None, super_column=None, timestamp=None):
+        return self._add((self.column_family.remove, key, columns, None))
+
+    def send(self, write_consistency_level=None):
+        mutations, self._mutations = self._mutations, []
+        for method, key, columns, timestamp in mutations:
+            method(key, columns, timestamp=timestamp)
+
+
+class FakeColumnFamily(object):
+
+    def __init__(self, pool, column_family, dict_class=OrderedDict,
+                 **kwargs):
+        self.pool = pool
+        self.column_family = column_family
+        self.dict_class = dict_class
+        self.rows = pool.column_families.setdefault(column_family, {})
+
+    def _get(self, key, columns=None, column_start='', column_finish='',
+             column_reversed=False, column_count=100):
+        row = self.rows.get(key)
+        if row is None:
+            return self.dict_class()
+        if columns is not None:
+            return self.dict_class(
+                (name, row.columns[name]) for name in columns
+                if name in row.columns
+            )
+        names = row.slice(column_start, column_finish, column_reversed,
+                          column_count)
+        return self.dict_class((name, row.columns[name]) for name in names)
+
+    def get(self, key, columns=None, column_start='', column_finish='',
+            column_reversed=False, column_count=100, **kwargs):
+        result = self._get(key, columns, column_start, column_finish,
+                           column_reversed, column_count)
+        if not result:
+            raise NotFoundException()
+        return result
+
+    def multiget(self, keys, columns=None, column_start='', column_finish='',
+                 column_reversed=False, column_count=100, buffer_size=None,
+                 **kwargs):
+        result = self.dict_class()
+        for key in keys:
+            row = self._get(key, columns, column_start, column_finish,
+                            column_reversed, column_count)
+            if row:
+                result[key] = row
+        return result
+
+    def xget(self, key, column_start='', column_finish='',
+             column_reversed=False, column_count=None, buffer_size=None,
+             **kwargs):
+        row = self.rows.get(key)
+        if row is None:
+            return
+        if column_count is None:
+            column_count = MAX_COLUMNS
+        names = row.slice(column_start, column_finish, column_reversed,
+                          column_count)
+        for name in names:
+            yield name, row.columns[name]
+
+    def get_count(self, key, column_start='', column_finish='', **kwargs):
+        row = self.rows.get(key)
+        if row is None:
+            return 0
+        return len(row.slice(column_start, column_finish))
+
+    def batch(self, queue_size=100, **kwargs):
+        return FakeMutator(self, queue_size)
+
+    def insert(self, key, columns, timestamp=None, **kwargs):
+        if key not in self.rows:
+            self.rows[key] = _Row()
+        self.rows[key].update(columns, timestamp)
+
+    def remove(self, key, columns=None, **kwargs):
+        if key not in self.rows:
+            return
+        if columns is None:
+            del self.rows[key]
+            return
+        self.rows[key].remove(columns)
+        if not self.rows[key].columns:
+            del self.rows[key]
+
+    def truncate(self):
+        self.rows.clear()
+
+
+class FakeDataStore(CassandraDataStore):
+    """A CassandraDataStore that keeps its data in memory.
+
+    Rows are kept per keyspace and column family with their column names
+    sorted, and sliced like Cassandra does. There is no network,
+    consistency or timestamps, so this measures (and tests) the client
+    side only. ``nodes`` are ignored; stores with the same ``keyspace``
+    share their data.
+
+    """
+    connection_pool_class = FakeConnectionPool
+    column_family_class = FakeColumnFamily
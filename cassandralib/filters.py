@@ -0,0 +1,83 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import numpy as np
+import pandas as pd
+
+# The flag of rejected values, see ignore_rejected.
+REJECTED = '6'
+
+
+def _with_bytes(values):
+    # Values come back as bytes or text depending on the column family.
+    values = set(values)
+    for value in list(values):
+        if not isinstance(value, bytes):
+            values.add(('%s' % value).encode('utf-8'))
+    return list(values)
+
+
+class Where(object):
+    """Conditions the timestamps returned by a read must meet.
+
+    - ``include_flags``: keep only timestamps whose flag is one of these.
+    - ``exclude_flags``: drop timestamps whose flag is one of these.
+    - ``ranges``: a dict of (min, max) by key; drop timestamps whose value
+      for that key is missing or outside the (inclusive) range. Either
+      bound may be None.
+
+    The conditions are evaluated as boolean masks over the keys they
+    refer to, before the other keys are assembled.
+
+    """
+
+    def __init__(self, include_flags=None, exclude_flags=None, ranges=None):
+        self.include_flags = include_flags
+        self.exclude_flags = exclude_flags
+        self.ranges = ranges or {}
+
+    def excluding(self, flags):
+        """Return a copy that also drops the given flags."""
+        return Where(self.include_flags,
+                     list(self.exclude_flags or []) + list(flags),
+                     self.ranges)
+
+    def keys(self):
+        keys = set(self.ranges)
+        if self.include_flags is not None or self.exclude_flags:
+            keys.add('flag')
+        return keys
+
+    def mask(self, length, columns, convert):
+        """Return a boolean mask of the timestamps to keep.
+
+        ``columns`` has the (rows, values) of every key, ``convert``
+        turns the values of a key into numbers.
+
+        """
+        keep = np.ones(length, dtype=bool)
+        flag_rows, flags = columns.get('flag', ([], []))
+        flags = pd.Series(flags, dtype=object)
+        if self.include_flags is not None:
+            included = np.zeros(length, dtype=bool)
+            included[flag_rows] = flags.isin(
+                _with_bytes(self.include_flags)
+            ).values
+            keep &= included
+        if self.exclude_flags:
+            excluded = flags.isin(_with_bytes(self.exclude_flags)).values
+            keep[np.asarray(flag_rows)[excluded]] = False
+        for key, (low, high) in self.ranges.items():
+            inside = np.zeros(length, dtype=bool)
+            if key in columns:
+                rows, values = columns[key]
+                values = convert(key, values)
+                ok = ~np.isnan(values)
+                if low is not None:
+                    ok &= values >= low
+                if high is not None:
+                    ok &= values <= high
+                inside[rows] = ok
+            keep &= inside
+        return keep
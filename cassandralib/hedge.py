@@ -0,0 +1,168 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import logging
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker(object):
+    """The latencies of the requests to every node in the last
+    ``max_age`` seconds, and the nodes that failed a request in the last
+    ``failure_timeout`` seconds."""
+
+    def __init__(self, max_age=60.0, failure_timeout=10.0):
+        self.max_age = max_age
+        self.failure_timeout = failure_timeout
+        self._latencies = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def _recent(self, node, now):
+        latencies = self._latencies.setdefault(node, deque())
+        while latencies and latencies[0][0] < now - self.max_age:
+            latencies.popleft()
+        return latencies
+
+    def record(self, node, seconds):
+        now = time.time()
+        with self._lock:
+            self._recent(node, now).append((now, seconds))
+
+    def fail(self, node):
+        """Record a failed request; its time says nothing about latency."""
+        with self._lock:
+            self._failures[node] = time.time()
+
+    def failed(self, node):
+        """Return whether a node failed a request recently."""
+        with self._lock:
+            failed_at = self._failures.get(node)
+        return failed_at is not None and \
+            failed_at >= time.time() - self.failure_timeout
+
+    def latencies(self, node=None):
+        """Return the recent latencies of a node (or of all nodes)."""
+        now = time.time()
+        with self._lock:
+            nodes = list(self._latencies) if node is None else [node]
+            return [seconds for node in nodes
+                    for _, seconds in self._recent(node, now)]
+
+    def ranked(self, nodes):
+        """Return nodes from fastest to slowest by median latency.
+
+        Nodes without recent requests come first, so that a node that
+        was slow is tried again once its latencies have expired. Nodes
+        that failed recently come last.
+
+        """
+        medians = {}
+        for node in nodes:
+            latencies = self.latencies(node)
+            medians[node] = np.median(latencies) if latencies else 0
+        return sorted(nodes, key=lambda node: (self.failed(node),
+                                               medians[node]))
+
+
+class HedgedReads(object):
+    """Send a read to a second node when the first is slow to answer.
+
+    A read goes to the node with the lowest recent median latency. If it
+    hasn't returned after the ``percentile`` of recent latencies (of all
+    nodes, but at least ``min_delay`` seconds, and ``initial_delay``
+    before there are ``min_samples`` of them), the same read is sent to
+    the next fastest node and the first response wins. The other one is
+    left to finish in the background; its latency is still recorded.
+
+    A read that fails is sent to the next node right away. Failures
+    aren't recorded as latencies; instead, the node is ranked last for
+    ``failure_timeout`` seconds.
+
+    Pass one as ``hedge`` to CassandraDataStore, which then keeps a
+    connection pool per node for reads.
+
+    """
+
+    def __init__(self, percentile=95, min_delay=0.005, initial_delay=0.1,
+                 min_samples=20, max_age=60.0, failure_timeout=10.0):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.tracker = LatencyTracker(max_age, failure_timeout)
+        self.hedged = 0
+        self.won = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self, max_workers):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def delay(self):
+        """Return the seconds to wait before sending the second read."""
+        latencies = self.tracker.latencies()
+        if len(latencies) < self.min_samples:
+            return self.initial_delay
+        return max(np.percentile(latencies, self.percentile), self.min_delay)
+
+    def _timed(self, node, function):
+        timer_start = time.time()
+        try:
+            result = function(node)
+        except Exception:
+            self.tracker.fail(node)
+            raise
+        self.tracker.record(node, time.time() - timer_start)
+        return result
+
+    def run(self, nodes, function):
+        """Return function(node) of the first node to answer."""
+        nodes = self.tracker.ranked(nodes)
+        futures = [self._executor.submit(self._timed, nodes[0], function)]
+        remaining = set(futures)
+        timeout = self.delay()
+        while True:
+            done, remaining = wait(remaining, timeout=timeout,
+                                   return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        self.won += 1
+                    return future.result()
+            if done:
+                # Send a read that failed to the next node.
+                retries = len(done)
+            else:
+                # The first read is slow; hedge it once.
+                retries = 1
+                timeout = None
+                if len(futures) < len(nodes):
+                    self.hedged += 1
+            for node in nodes[len(futures):len(futures) + retries]:
+                logger.debug("Hedging a read on %s after %s", node,
+                             nodes[0])
+                futures.append(self._executor.submit(self._timed, node,
+                                                     function))
+                remaining.add(futures[-1])
+            if not remaining:
+                # Every read failed; raise the error of the first one.
+                return futures[0].result()
+
+    def stats(self):
+        return {
+            'hedged': self.hedged,
+            'won': self.won,
+            'delay': self.delay(),
+        }
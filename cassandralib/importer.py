@@ -0,0 +1,298 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+"""Import CSV and Parquet files into Cassandra with a pool of processes.
+
+Files are read one at a time and split into partitions (the rows of one
+sensor and bucket), which are handed out to the worker processes. Every
+worker writes with its own CassandraDataStore, in batches of a bounded
+number of rows. Every partition (file, sensor and bucket) that has been
+committed is appended to the checkpoint file, if any, and skipped when
+the import is run again.
+
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from cassandralib.models import BUCKET_UNITS
+from cassandralib.models import BucketFormat
+from cassandralib.models import CassandraDataStore
+from cassandralib.models import bucket_format
+from cassandralib.models import register_bucket_format
+
+BUCKET_FORMATS = {
+    'hourly': BucketFormat.HOURLY,
+    'daily': BucketFormat.DAILY,
+    'monthly': BucketFormat.MONTHLY,
+    'yearly': BucketFormat.YEARLY,
+}
+
+# The options and store of a worker process, see _start_worker().
+_worker = {}
+
+
+def read_file(path, time_column='datetime', timezone='UTC',
+              ambiguous='infer', nonexistent='shift_forward'):
+    """Return a file as a DataFrame indexed by timezone aware datetimes.
+
+    Files ending in '.parquet' or '.pq' are read as Parquet (which needs
+    pyarrow), others as CSV. Naive timestamps are in ``timezone``.
+    ``ambiguous`` and ``nonexistent`` are passed to tz_localize() for the
+    hours around DST transitions: by default, a repeated hour is told
+    apart by the order of its timestamps, and a skipped hour moves to the
+    end of the transition.
+
+    """
+    if path.endswith(('.parquet', '.pq')):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    index = pd.DatetimeIndex(pd.to_datetime(df.pop(time_column)))
+    if index.tz is None:
+        index = index.tz_localize(pytz.timezone(timezone),
+                                  ambiguous=ambiguous,
+                                  nonexistent=nonexistent)
+    df.index = index
+    return df
+
+
+def partitions(df, sensor_id=None, sensor_column='sensor_id',
+               format=None):
+    """Yield (sensor_id, bucket, DataFrame) of the rows of every bucket.
+
+    The sensor is the value in ``sensor_column`` if the frame has it,
+    ``sensor_id`` otherwise. Buckets are in ``format``, or the bucket
+    format of the sensor if None.
+
+    """
+    if sensor_column in df.columns:
+        groups = df.groupby(df.pop(sensor_column).astype(str).values)
+    else:
+        groups = [(sensor_id, df)]
+    for sensor_id, sensor_df in groups:
+        unit = BUCKET_UNITS[format or bucket_format(sensor_id)]
+        datetimes = np.asarray(sensor_df.index.values,
+                               dtype='datetime64[%s]' % unit)
+        buckets = np.datetime_as_string(datetimes, unit=unit)
+        for bucket, bucket_df in sensor_df.groupby(buckets):
+            yield sensor_id, bucket, bucket_df.sort_index()
+
+
+class Throttle(object):
+    """Sleep to keep the rate of rows below ``rate`` per second."""
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.rows = 0
+        self.started = time.time()
+
+    def __call__(self, rows):
+        self.rows += rows
+        if self.rate:
+            ahead = self.rows / float(self.rate) - \
+                (time.time() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def _start_worker(options):
+    datastore = CassandraDataStore(options['nodes'], options['keyspace'],
+                                   options['batch_size'])
+    if options['index']:
+        datastore.add_index(options['column_family'], options['index'])
+    _worker.update(options, datastore=datastore,
+                   throttle=Throttle(options['rate']))
+
+
+def _import_partition(job):
+    """Write the rows of one sensor and bucket (in a worker). Returns the
+    path, sensor_id, bucket, the rows written and the seconds taken."""
+    path, sensor_id, bucket, part = job
+    options = _worker
+    datastore = options['datastore']
+    column_family = options['column_family']
+    batch_size = options['batch_size']
+    timer_start = time.time()
+    if options['bucket_format']:
+        register_bucket_format(sensor_id, options['bucket_format'])
+    for first in range(0, len(part), batch_size):
+        chunk = part.iloc[first:first + batch_size]
+        datastore.write_frame(column_family, sensor_id, chunk, batch_size)
+        datastore.commit(column_family)
+        options['throttle'](len(chunk))
+    return path, sensor_id, bucket, len(part), time.time() - timer_start
+
+
+def load_checkpoint(path):
+    """Return the set of (path, sensor_id, bucket) partitions done."""
+    done = set()
+    if path and os.path.exists(path):
+        with open(path) as checkpoint:
+            for line in checkpoint:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut off by a crash; its partition is redone.
+                    continue
+                done.add((entry['path'], entry['sensor_id'],
+                          entry['bucket']))
+    return done
+
+
+def _jobs(paths, options, done, slots, stop):
+    # Read the files one by one and yield their partitions that aren't
+    # done. A slot is taken for every partition, so that no more than a
+    # few are read ahead of the workers, until ``stop`` is set.
+    for path in paths:
+        df = read_file(path, options['time_column'], options['timezone'])
+        if options['columns']:
+            keep = options['columns'] + [options['sensor_column']]
+            df = df[[column for column in df.columns if column in keep]]
+        sensor_id = os.path.splitext(os.path.basename(path))[0]
+        for sensor_id, bucket, part in partitions(
+                df, sensor_id, options['sensor_column'],
+                options['bucket_format']):
+            if (path, sensor_id, bucket) in done:
+                continue
+            slots.acquire()
+            if stop.is_set():
+                return
+            yield path, sensor_id, bucket, part
+
+
+def run(paths, options, processes=None, report=print):
+    """Import files with ``processes`` worker processes (the number of
+    CPUs if None, in this process if 0) and return the rows written.
+
+    ``options`` are as parsed by main(). Progress is passed to
+    ``report`` as a line of text per partition.
+
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    done = load_checkpoint(options['checkpoint'])
+    workers = processes or multiprocessing.cpu_count()
+    if options['rate'] and processes != 0:
+        # Every worker gets its share of the rate.
+        options = dict(options, rate=options['rate'] / float(workers))
+    # Two partitions per worker are read ahead; the pool would otherwise
+    # read all files at once.
+    slots = threading.Semaphore(2 * workers)
+    stop = threading.Event()
+    jobs = _jobs(paths, options, done, slots, stop)
+
+    if processes == 0:
+        _start_worker(options)
+        results = map(_import_partition, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes, _start_worker, (options,))
+        results = pool.imap_unordered(_import_partition, jobs)
+
+    total = 0
+    timer_start = time.time()
+    try:
+        for count, (path, sensor_id, bucket, rows, seconds) in \
+                enumerate(results, 1):
+            slots.release()
+            if options['checkpoint']:
+                line = json.dumps({'path': path, 'sensor_id': sensor_id,
+                                   'bucket': bucket, 'rows': rows})
+                with open(options['checkpoint'], 'a') as checkpoint:
+                    checkpoint.write(line + '\n')
+            total += rows
+            elapsed = time.time() - timer_start
+            report('[%d] %s %s %s: %d rows in %.1fs, %.0f rows/s in total' % (
+                count, path, sensor_id, bucket, rows, seconds,
+                total / elapsed if elapsed else 0
+            ))
+    except BaseException:
+        # Let the pool's feeder thread out of _jobs(), then stop it.
+        stop.set()
+        slots.release()
+        if pool is not None:
+            pool.terminate()
+            pool = None
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return total
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Import CSV and Parquet files into a Cassandra column "
+        "family. Every file has a time column, optionally a sensor column "
+        "(otherwise the file name is the sensor_id) and a column per key.")
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help="CSV or Parquet (.parquet, .pq) file")
+    parser.add_argument('--nodes', required=True,
+                        help="Cassandra nodes, comma separated host:port")
+    parser.add_argument('--keyspace', required=True)
+    parser.add_argument('--column-family', required=True)
+    parser.add_argument(
+        '--index', help="index column family of the column family, to "
+        "keep up to date (see CassandraDataStore.add_index())")
+    parser.add_argument(
+        '--bucket-format', choices=sorted(BUCKET_FORMATS),
+        help="bucket format of the sensors (default: yearly)")
+    parser.add_argument(
+        '--time-column', default='datetime',
+        help="column with the timestamps (default: %(default)s)")
+    parser.add_argument(
+        '--timezone', default='UTC',
+        help="timezone of naive timestamps (default: %(default)s)")
+    parser.add_argument(
+        '--sensor-column', default='sensor_id',
+        help="column with the sensor_id (default: %(default)s)")
+    parser.add_argument(
+        '--columns', help="keys to import, comma separated (default: all "
+        "other columns)")
+    parser.add_argument(
+        '--processes', type=int,
+        help="worker processes (default: the number of CPUs, 0 to import "
+        "in this process)")
+    parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help="rows written per commit (default: %(default)s)")
+    parser.add_argument(
+        '--max-rate', type=float,
+        help="maximum rows per second of all processes together, to "
+        "leave room for other writes")
+    parser.add_argument(
+        '--checkpoint', help="file of the partitions done; partitions in "
+        "it are skipped, so an import can be resumed")
+    options = parser.parse_args(args)
+
+    bucketformat = BUCKET_FORMATS.get(options.bucket_format)
+    run(options.paths, {
+        'nodes': options.nodes.split(','),
+        'keyspace': options.keyspace,
+        'column_family': options.column_family,
+        'index': options.index,
+        'bucket_format': bucketformat,
+        'time_column': options.time_column,
+        'timezone': options.timezone,
+        'sensor_column': options.sensor_column,
+        'columns': options.columns.split(',') if options.columns else None,
+        'batch_size': options.batch_size,
+        'rate': options.max_rate,
+        'checkpoint': options.checkpoint,
+    }, options.processes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import bisect
+import threading
+
+# Upper bounds of the histogram buckets of durations (in seconds) and of
+# everything else (counts of rowkeys, columns, rows and bytes).
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000,
+                100000000, 1000000000)
+
+
+class Collector(object):
+    """Receives the measurements of a CassandraDataStore.
+
+    Pass one as ``metrics`` to the store. observe() is called with a
+    metric name, a value and labels (the column family) for:
+
+    - fetch_seconds, parse_seconds, convert_seconds and frame_seconds:
+      the duration of the phases of a read (multiget, pivoting the
+      columns, converting values and building the DataFrame);
+    - read_rowkeys: the number of rowkeys requested;
+    - read_columns and read_bytes: the columns returned and the size of
+      their names and values;
+    - filtered_rows: the timestamps dropped by ``where`` or
+      ``ignore_rejected``;
+    - commit_columns and commit_seconds: the size of a batch and the time
+      it took to send it;
+    - writer_flush_seconds: the time a BackgroundWriter took to flush.
+
+    Without a collector, the store doesn't measure anything. This base
+    class ignores every measurement; subclasses override observe().
+
+    """
+
+    def observe(self, name, value, **labels):
+        pass
+
+
+class HistogramCollector(Collector):
+    """Keep a histogram, sum and count of every metric in memory.
+
+    Metrics ending in '_seconds' use TIME_BUCKETS, others SIZE_BUCKETS,
+    unless ``buckets`` (a dict of bucket upper bounds by metric name)
+    says otherwise. Safe to use from several threads.
+
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _bounds(self, name):
+        if name in self.buckets:
+            return tuple(self.buckets[name])
+        if name.endswith('_seconds'):
+            return TIME_BUCKETS
+        return SIZE_BUCKETS
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                bounds = self._bounds(name)
+                histogram = self._histograms[key] = {
+                    'bounds': bounds,
+                    'counts': [0] * (len(bounds) + 1),
+                    'sum': 0,
+                    'count': 0,
+                }
+            histogram['counts'][bisect.bisect_left(histogram['bounds'],
+                                                   value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """Return a copy of the histograms.
+
+        A dict by (name, labels) of dicts with the bucket 'bounds', the
+        (non-cumulative) 'counts' per bucket plus one for larger values,
+        and the 'sum' and 'count' of all values. Labels are a sorted
+        tuple of (label, value).
+
+        """
+        with self._lock:
+            return dict(
+                (key, dict(histogram, counts=list(histogram['counts'])))
+                for key, histogram in self._histograms.items()
+            )
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+def _escape(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    labels = list(labels) + sorted(extra.items())
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (label, _escape(value))
+                             for label, value in labels)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else '%d' % value
+
+
+def to_prometheus(collector, prefix='cassandralib_'):
+    """Return the histograms of a HistogramCollector in the Prometheus
+    text exposition format."""
+    lines = []
+    histograms = collector.snapshot()
+    for name in sorted(set(name for name, labels in histograms)):
+        metric = prefix + name
+        lines.append('# TYPE %s histogram' % metric)
+        for key in sorted(key for key in histograms if key[0] == name):
+            histogram = histograms[key]
+            labels = key[1]
+            total = 0
+            for bound, count in zip(histogram['bounds'],
+                                    histogram['counts']):
+                total += count
+                lines.append('%s_bucket%s %d' % (
+                    metric, _labels(labels, le=_number(bound)), total
+                ))
+            lines.append('%s_bucket%s %d' % (
+                metric, _labels(labels, le='+Inf'), histogram['count']
+            ))
+            lines.append('%s_sum%s %s' % (metric, _labels(labels),
+                                          _number(histogram['sum'])))
+            lines.append('%s_count%s %d' % (metric, _labels(labels),
+                                            histogram['count']))
+    return '\n'.join(lines) + '\n'
@@ -2,9 +2,13 @@
 
 from __future__ import unicode_literals
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from datetime import timedelta
 from dateutil.relativedelta import relativedelta
 import logging
+import threading
+import time
 
 from pycassa.cassandra.ttypes import NotFoundException
 import numpy as np
@@ -12,12 +16,30 @@ import pandas as pd
 import pycassa
 import pytz
 
+from cassandralib.aggregate import Aggregator
+from cassandralib.aggregate import PARTIALS
+from cassandralib.aggregate import Rollup
+from cassandralib.aggregate import combine
+from cassandralib.aggregate import nanoseconds
+from cassandralib.filters import REJECTED
+from cassandralib.filters import Where
+from cassandralib.output import check_output
+from cassandralib.output import frame_to_output
+from cassandralib.output import to_output
+from cassandralib.schema import CONVERSIONS
+from cassandralib.schema import to_float
 
 INTERNAL_TIMEZONE = pytz.UTC
 COLNAME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
 COLNAME_FORMAT_MS = '%Y-%m-%dT%H:%M:%S.%fZ'
 COLNAME_SEPERATOR = '_'
 MAX_COLUMNS = 2147483647
+DEFAULT_PAGE_SIZE = 10000
+DEFAULT_ROW_COLUMNS = 1000000
+# No more data is expected for a bucket this long after its end.
+CLOSED_AFTER = timedelta(hours=1)
+# The shortest column sub-range a bucket row is split into for fan-out.
+MIN_FAN_OUT_SPAN = timedelta(hours=1)
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +51,78 @@ class BucketFormat:
     YEARLY = '%Y'
 
 
+class BucketFormats(object):
+    """The bucket formats of sensors, kept in this process.
+
+    Every process that reads or writes a sensor must agree on its format,
+    so either register it in every process or use a registry they share,
+    like ColumnFamilyBucketFormats. Subclasses may also look the format
+    up elsewhere, or derive it (from a sampling rate with
+    suitable_bucket_format(), for instance). Pass one to
+    use_bucket_formats() to use it.
+
+    """
+    # Seconds it takes for a change to be seen by every process.
+    max_age = 0
+
+    def __init__(self, default=BucketFormat.YEARLY):
+        self.default = default
+        self.formats = {}
+
+    def get(self, sensor_id):
+        return self.formats.get(sensor_id, self.default)
+
+    def set(self, sensor_id, bucketformat):
+        self.formats[sensor_id] = bucketformat
+
+
+# The registry of bucket formats, see use_bucket_formats().
+bucket_formats = BucketFormats()
+
+
+def use_bucket_formats(registry):
+    """Look up the bucket formats of sensors in another registry."""
+    global bucket_formats
+    bucket_formats = registry
+
+
 def bucket_format(sensor_id):
-    return BucketFormat.YEARLY
+    return bucket_formats.get(sensor_id)
+
+
+def register_bucket_format(sensor_id, bucketformat):
+    bucket_formats.set(sensor_id, bucketformat)
+
+
+def suitable_bucket_format(interval, max_columns=DEFAULT_ROW_COLUMNS):
+    """Return the coarsest bucket format for a sampling interval.
+
+    ``interval`` is a timedelta. The returned format keeps the number of
+    timestamps on one Cassandra row below ``max_columns``.
+
+    """
+    seconds = interval.days * 86400 + interval.seconds + \
+        interval.microseconds / 1e6
+    longest = [
+        (BucketFormat.YEARLY, 366 * 86400),
+        (BucketFormat.MONTHLY, 31 * 86400),
+        (BucketFormat.DAILY, 86400),
+        (BucketFormat.HOURLY, 3600),
+    ]
+    for bucketformat, length in longest:
+        if length <= seconds * max_columns:
+            return bucketformat
+    return BucketFormat.HOURLY
+
+
+# The numpy datetime unit whose ISO 8601 representation matches each
+# bucket format, for formatting many timestamps at once.
+BUCKET_UNITS = {
+    BucketFormat.HOURLY: 'h',
+    BucketFormat.DAILY: 'D',
+    BucketFormat.MONTHLY: 'M',
+    BucketFormat.YEARLY: 'Y',
+}
 
 
 def bucket_delta(bucketformat):
@@ -72,34 +164,343 @@ def strptime(dt):
         int(dt[11:13]), int(dt[14:16]), int(dt[17:19]))
 
 
+# Positions of the digits of every field of COLNAME_FORMAT(_MS)
+# timestamps.
+_STAMP_FIELDS = [
+    ('Y', [0, 1, 2, 3]), ('M', [5, 6]), ('D', [8, 9]), ('h', [11, 12]),
+    ('m', [14, 15]), ('s', [17, 18]), ('us', [20, 21, 22, 23, 24, 25]),
+]
+
+
+def _parse_stamps(chars):
+    # Parse a 2d array of the characters of timestamps without the 'Z',
+    # by doing the arithmetic on the digits. This is a lot faster than
+    # astype('datetime64'), which parses every string by itself.
+    width = chars.shape[1]
+    if width not in (19, 26):
+        stamps = np.ascontiguousarray(chars).view(
+            '%s%d' % (chars.dtype.char, width)
+        ).ravel()
+        return stamps.astype('datetime64[us]')
+    digits = chars.view(np.uint32 if chars.dtype.char == 'U' else np.uint8)
+    fields = {}
+    for field, positions in _STAMP_FIELDS:
+        if positions[-1] >= width:
+            fields[field] = 0
+            continue
+        value = np.zeros(len(chars), dtype=np.int64)
+        for position in positions:
+            value *= 10
+            value += digits[:, position]
+            value -= 48
+        fields[field] = value
+    months = (fields['Y'] - 1970) * 12 + fields['M'] - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') \
+        .astype(np.int64) + fields['D'] - 1
+    seconds = ((days * 24 + fields['h']) * 60 + fields['m']) * 60 + \
+        fields['s']
+    return (seconds * 1000000 + fields['us']).view('datetime64[us]')
+
+
+def _chars(strings):
+    # View an array of strings as a 2d array of character codes.
+    strings = np.asarray(strings)
+    return strings.view(np.uint32).reshape(len(strings), -1)
+
+
+# The characters of 'HH:MM:SS' for every second of a day and of '000' to
+# '999', see _column_prefixes().
+_TIME_CHARS = []
+
+
+def _column_prefixes(datetimes):
+    # Return the '<COLNAME_FORMAT_MS timestamp>_' that starts the column
+    # names of datetime64 timestamps. The characters of the date of every
+    # unique day, the time of day and the microseconds are looked up and
+    # put together, which is a lot faster than np.datetime_as_string().
+    if not _TIME_CHARS:
+        seconds = np.arange(86400).astype('datetime64[s]')
+        _TIME_CHARS.append(
+            _chars(np.datetime_as_string(seconds))[:, 11:19].copy()
+        )
+        _TIME_CHARS.append(_chars(np.char.zfill(
+            np.arange(1000).astype('U3'), 3
+        )))
+    times, thousands = _TIME_CHARS
+
+    microseconds = np.asarray(datetimes, dtype='datetime64[us]') \
+        .view(np.int64)
+    days, rest = np.divmod(microseconds, 86400000000)
+    seconds, fraction = np.divmod(rest, 1000000)
+    unique, inverse = np.unique(days, return_inverse=True)
+    dates = np.datetime_as_string(unique.astype('datetime64[D]'))
+    chars = np.empty((len(microseconds), 28), dtype=np.uint32)
+    chars[:, :10] = _chars(dates)[:, :10][inverse.ravel()]
+    chars[:, 10] = ord('T')
+    chars[:, 11:19] = times[seconds]
+    chars[:, 19] = ord('.')
+    chars[:, 20:23] = thousands[fraction // 1000]
+    chars[:, 23:26] = thousands[fraction % 1000]
+    chars[:, 26] = ord('Z')
+    chars[:, 27] = ord(COLNAME_SEPERATOR)
+    return chars.view('U28').ravel()
+
+
+def _to_text(values):
+    # Format values like str() does. Sensors tend to repeat values, so
+    # numbers are formatted once per unique value, which is the slow part.
+    if values.dtype.kind in 'fiu':
+        # Compare the bits, or -0.0 would be formatted like 0.0.
+        bits = np.ascontiguousarray(values).view('i%d' % values.itemsize)
+        unique, inverse = np.unique(bits, return_inverse=True)
+        return unique.view(values.dtype).astype(str)[inverse.ravel()]
+    return values.astype(str)
+
+
+def split_column_names(names):
+    """Split column names into timestamps and keys.
+
+    Column names look like ``<timestamp>_<key>``. Returns a
+    ``datetime64[us]`` array of timestamps, an array of keys and the
+    positions in ``names`` they came from. Names without a separator are
+    skipped.
+
+    Timestamps have the same width for all columns written in the same
+    format, so instead of splitting every name in Python, the names are
+    viewed as a 2d array of characters and sliced per separator position.
+
+    """
+    names = np.asarray(names)
+    positions = np.char.find(names, COLNAME_SEPERATOR)
+    char = np.dtype(names.dtype.char + '1')
+    width = names.dtype.itemsize // char.itemsize
+    chars = names.view(char).reshape(len(names), width)
+
+    datetimes, keys, indices = [], [], []
+    for pos in np.unique(positions):
+        if pos < 1:
+            continue
+        index = np.flatnonzero(positions == pos)
+        # Strip the trailing 'Z' from the timestamp.
+        datetimes.append(_parse_stamps(chars[index, :pos - 1]))
+        key_chars = np.ascontiguousarray(chars[index, pos + 1:])
+        keys.append(key_chars.view(
+            '%s%d' % (char.char, width - pos - 1)
+        ).ravel())
+        indices.append(index)
+
+    if not indices:
+        return np.array([], dtype='datetime64[us]'), \
+            np.array([], dtype=char), np.array([], dtype=int)
+    if len(indices) == 1:
+        return datetimes[0], keys[0], indices[0]
+    return np.concatenate(datetimes), np.concatenate(keys), \
+        np.concatenate(indices)
+
+
+def parse_columns(names, values, params=None):
+    """Pivot flat lists of column names and values per key.
+
+    Returns a sorted ``datetime64[ns]`` array of unique timestamps, a
+    sorted list of keys, and for every key an array of the positions (in
+    the timestamps) it has values for and an array of those values.
+    Columns whose key is not in ``params`` (if given) are skipped.
+
+    """
+    if len(names) == 0:
+        return np.array([], dtype='datetime64[ns]'), [], [], []
+
+    datetimes, keys, indices = split_column_names(names)
+    values = np.asarray(values, dtype=object)[indices]
+    if params:
+        mask = pd.Series(keys).isin(list(params)).values
+        datetimes, keys, values = datetimes[mask], keys[mask], values[mask]
+
+    row_idx, datetimes = pd.factorize(datetimes, sort=True)
+    col_idx, keys = pd.factorize(keys, sort=True)
+
+    order = np.argsort(col_idx, kind='mergesort')
+    bounds = np.cumsum(np.bincount(col_idx, minlength=len(keys)))[:-1]
+    rows = np.split(row_idx[order], bounds)
+    values = np.split(values[order], bounds)
+    return np.asarray(datetimes).astype('datetime64[ns]'), keys.tolist(), \
+        rows, values
+
+
+def _microseconds(stamp):
+    # Microseconds since epoch of a COLNAME_FORMAT_MS timestamp.
+    return int(np.datetime64(stamp.rstrip('Z'), 'us').astype(np.int64))
+
+
+def _written_frame(data):
+    # The frames and (timestamp, row) tuples written to a sensor, in
+    # order, as one frame with the last value written per timestamp and
+    # key.
+    frames = []
+    rows = []
+    for item in list(data) + [None]:
+        if isinstance(item, tuple):
+            rows.append(item)
+            continue
+        if rows:
+            frames.append(pd.DataFrame(
+                [row for _, row in rows],
+                index=pd.DatetimeIndex([stamp for stamp, _ in rows])
+            ))
+            rows = []
+        if item is not None:
+            frames.append(item.tz_convert(INTERNAL_TIMEZONE))
+    return pd.concat(frames).groupby(level=0).last()
+
+
+def _combine(sensor_ids, frames, as_dict, output='pandas'):
+    # Return DataFrames by sensor_id as read_many() does.
+    if as_dict or output != 'pandas':
+        return frames
+    # Sensors without data don't get any columns.
+    sensor_ids = [sensor_id for sensor_id in sensor_ids
+                  if len(frames[sensor_id].columns)]
+    if not sensor_ids:
+        return pd.DataFrame()
+    return pd.concat([frames[sensor_id] for sensor_id in sensor_ids],
+                     axis=1, keys=sensor_ids)
+
+
+class ColumnFamilyBucketFormats(BucketFormats):
+    """Bucket formats kept in a column family, shared by all processes.
+
+    The formats are kept as columns of one row, which is read (at QUORUM)
+    again once it is older than ``max_age`` seconds, so every process
+    sees a change within that time.
+
+    """
+    rowkey = 'bucket_formats'
+
+    def __init__(self, datastore, column_family, max_age=60,
+                 default=BucketFormat.YEARLY):
+        BucketFormats.__init__(self, default)
+        self.column_family = datastore._get_column_family(column_family)
+        self.max_age = max_age
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def get(self, sensor_id):
+        now = time.time()
+        with self._lock:
+            if self._loaded is None or now - self._loaded >= self.max_age:
+                try:
+                    row = self.column_family.get(
+                        self.rowkey, column_count=MAX_COLUMNS,
+                        read_consistency_level=pycassa.ConsistencyLevel.QUORUM
+                    )
+                except NotFoundException:
+                    row = {}
+                self.formats = dict(row)
+                self._loaded = now
+        return BucketFormats.get(self, sensor_id)
+
+    def set(self, sensor_id, bucketformat):
+        self.column_family.insert(
+            self.rowkey, {sensor_id: bucketformat},
+            write_consistency_level=pycassa.ConsistencyLevel.QUORUM
+        )
+        with self._lock:
+            self.formats = dict(self.formats)
+            self.formats[sensor_id] = bucketformat
+
+
+class _ThreadState(threading.local):
+    # Unsent mutations are kept per thread, so threads sharing a store
+    # can't send (or corrupt) each other's batches.
+    def __init__(self):
+        self.batches = {}
+        self.pending = {}
+        # What was written per column family and sensor since the last
+        # commit, for the rollups: the frames and rows written, and the
+        # last existing timestamp (ns) by period of each base rollup.
+        self.written = {}
+        # Columns in the batches, only counted for metrics.
+        self.buffered = {}
+        # The first and last column written per column family, sensor
+        # and bucket, for the index.
+        self.bounds = {}
+
+
 class CassandraDataStore(object):
-    _column_families = {}
-    _batches = {}
+    # Replaced by cassandralib.fake to run without a cluster.
+    connection_pool_class = pycassa.ConnectionPool
+    column_family_class = pycassa.ColumnFamily
 
-    def __init__(self, nodes, keyspace, queue_size):
-        self.pool = pycassa.ConnectionPool(
-            keyspace=keyspace, server_list=nodes, prefill=False, max_overflow=0
+    def __init__(self, nodes, keyspace, queue_size, cache=None, pool_size=5,
+                 prefill=False, max_overflow=0, metrics=None, latest=None,
+                 fan_out=1, hedge=None, decoder=None):
+        self.pool = self.connection_pool_class(
+            keyspace=keyspace, server_list=nodes, pool_size=pool_size,
+            prefill=prefill, max_overflow=max_overflow
         )
+        self.nodes = nodes
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
         self.queue_size = queue_size
         self.read_consistency_level = pycassa.ConsistencyLevel.ONE
         self.write_consistency_level = pycassa.ConsistencyLevel.QUORUM
+        # Optional cassandralib.cache.BucketCache for closed buckets.
+        self.cache = cache
+        self._column_families = {}
+        self._local = _ThreadState()
+        # Rollups by column family, finest resolution first.
+        self.rollups = {}
+        # Codecs by column family and key, see set_codec().
+        self.codecs = {}
+        # Fields by column family and key, see set_schema().
+        self.schemas = {}
+        # Optional cassandralib.metrics.Collector.
+        self.metrics = metrics
+        # Optional cassandralib.cache.LatestCache, see read_latest().
+        self.latest = latest
+        # Index column families by column family, see add_index().
+        self.indexes = {}
+        # The maximum number of concurrent sub-requests of a multiget, see
+        # _split(). Each takes a connection, so mind pool_size.
+        self.fan_out = fan_out
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # Optional cassandralib.parallel.DecodePool for large reads.
+        self.decoder = decoder
+        # Optional cassandralib.hedge.HedgedReads. Hedged reads need to
+        # choose the node, so they use a pool per node.
+        self.hedge = hedge
+        self._node_pools = {}
+        if hedge is not None:
+            for node in nodes:
+                self._node_pools[node] = self.connection_pool_class(
+                    keyspace=keyspace, server_list=[node],
+                    pool_size=pool_size, prefill=prefill,
+                    max_overflow=max_overflow
+                )
+            hedge.start(len(nodes) * (pool_size + max(max_overflow, 0)))
 
-    def _get_column_family(self, column_family):
-        if column_family not in self._column_families:
-            self._column_families[column_family] = \
-                pycassa.ColumnFamily(self.pool, column_family,
+    def _get_column_family(self, column_family, node=None):
+        key = column_family if node is None else (column_family, node)
+        if key not in self._column_families:
+            pool = self.pool if node is None else self._node_pools[node]
+            self._column_families[key] = \
+                self.column_family_class(pool, column_family,
                     write_consistency_level=self.write_consistency_level,
-                    read_consistency_level=self.read_consistency_level)
-        return self._column_families[column_family]
+                    read_consistency_level=self.read_consistency_level,
+                    # Columns are sorted while parsing, so skip the (slow)
+                    # OrderedDict pycassa uses by default.
+                    dict_class=dict)
+        return self._column_families[key]
 
     def _get_batch(self, column_family):
-        if column_family not in self._batches:
+        batches = self._local.batches
+        if column_family not in batches:
             cf = self._get_column_family(column_family)
-            self._batches[column_family] = cf.batch(queue_size=self.queue_size)
-        return self._batches[column_family]
+            batches[column_family] = cf.batch(queue_size=self.queue_size)
+        return batches[column_family]
 
-    def read(self, column_family, sensor_id, start, end, params=[],
-             convert_values_to=None, ignore_rejected=None):
+    def _check_range(self, start, end):
         if start:
             assert start.tzinfo is not None, \
                 "Start datetime must be timezone aware"
@@ -113,11 +514,10 @@ class CassandraDataStore(object):
                 str(end.tzinfo.utcoffset(end))[1:] == ':30:00', \
                 "End datetime has weird utc offset; use tz.localize"
 
-        if start is None or end is None:
-            return pd.DataFrame()
-
+    def _rowkeys(self, sensor_id, start, end, format=None):
         # The bucket format defines how much data is on one Cassandra row.
-        format = bucket_format(sensor_id)
+        if format is None:
+            format = bucket_format(sensor_id)
 
         key_format = sensor_id + ":" + format
         stamp = bucket_start(start.astimezone(INTERNAL_TIMEZONE), format)
@@ -129,102 +529,1267 @@ class CassandraDataStore(object):
         while stamp < end:
             rowkeys.append(stamp.strftime(key_format))
             stamp += delta
+        return rowkeys
+
+    def _column_range(self, start, end):
+        # An open end (None) is an empty column name.
+        col_start = col_end = ''
+        if start is not None:
+            col_start = start.astimezone(INTERNAL_TIMEZONE) \
+                .strftime(COLNAME_FORMAT_MS)
+        if end is not None:
+            col_end = end.astimezone(INTERNAL_TIMEZONE) \
+                .strftime(COLNAME_FORMAT_MS)
+        return col_start, col_end
+
+    def _buckets(self, column_family, sensor_ids, start, end):
+        """Return the sensor_id by rowkey of the bucket rows to read.
+
+        Without an index, these are all buckets between start and end,
+        or none if either is None. With one, only the buckets with data
+        in the range, which may be open-ended.
+
+        """
+        rowkeys = {}
+        if column_family not in self.indexes:
+            if start is not None and end is not None:
+                for sensor_id in sensor_ids:
+                    for rowkey in self._rowkeys(sensor_id, start, end):
+                        rowkeys[rowkey] = sensor_id
+            return rowkeys
+
+        col_start, col_end = self._column_range(start, end)
+        index = self._multiget(self.indexes[column_family], sensor_ids,
+                               '', '')
+        for sensor_id in sensor_ids:
+            columns = index.get(sensor_id, {})
+            # Skip buckets of another bucket format, e.g. before a
+            # rebucket().
+            width = len(datetime(2000, 1, 1).strftime(
+                bucket_format(sensor_id)
+            ))
+            for name in columns:
+                bucket, bound = name.rsplit(COLNAME_SEPERATOR, 1)
+                if bound != 'first' or len(bucket) != width:
+                    continue
+                first = columns[name]
+                last = columns.get(bucket + COLNAME_SEPERATOR + 'last', first)
+                if (not col_end or first < col_end) and \
+                        (not col_start or last >= col_start):
+                    rowkeys[sensor_id + ':' + bucket] = sensor_id
+        return rowkeys
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.fan_out)
+        return self._executor
+
+    def _split(self, rowkeys, col_start, col_end):
+        """Return up to fan_out (rowkeys, col_start, col_end) requests.
+
+        Rowkeys are divided over the requests; when there are fewer of
+        them than fan_out, every bucket row is split into column
+        sub-ranges of equal duration (but at least MIN_FAN_OUT_SPAN).
+
+        """
+        if len(rowkeys) >= self.fan_out:
+            bounds = [len(rowkeys) * i // self.fan_out
+                      for i in range(self.fan_out + 1)]
+            return [(rowkeys[first:last], col_start, col_end)
+                    for first, last in zip(bounds, bounds[1:])]
+
+        requests = []
+        minimum = int(MIN_FAN_OUT_SPAN.total_seconds() * 1e6)
+        for i, rowkey in enumerate(rowkeys):
+            pieces = self.fan_out // len(rowkeys) + \
+                (i < self.fan_out % len(rowkeys))
+            sensor_id, stamp = rowkey.rsplit(':', 1)
+            format = bucket_format(sensor_id)
+            bucket = datetime.strptime(stamp, format)
+            first = np.datetime64(bucket, 'us')
+            last = np.datetime64(bucket + bucket_delta(format), 'us')
+            if col_start:
+                first = max(first, np.datetime64(col_start.rstrip('Z'), 'us'))
+            if col_end:
+                last = min(last, np.datetime64(col_end.rstrip('Z'), 'us'))
+            span = (last - first).astype(np.int64)
+            pieces = max(min(pieces, span // minimum), 1)
+            # Names with a stamp on a boundary sort after it, so they are
+            # only in the next sub-range.
+            bounds = first + np.arange(1, pieces) * (span // pieces)
+            bounds = np.char.add(np.datetime_as_string(bounds, unit='us'),
+                                 'Z').tolist()
+            bounds = [col_start] + bounds + [col_end]
+            for piece in range(pieces):
+                requests.append(([rowkey], bounds[piece], bounds[piece + 1]))
+        return requests
+
+    def _multiget(self, column_family, rowkeys, col_start, col_end,
+                  batch_size=None, column_reversed=False,
+                  column_count=MAX_COLUMNS, read_consistency_level=None):
+        kwargs = {}
+        if batch_size is not None:
+            kwargs['buffer_size'] = batch_size
+        if read_consistency_level is not None:
+            kwargs['read_consistency_level'] = read_consistency_level
+        requests = [(rowkeys, col_start, col_end)]
+        if self.fan_out > 1 and not column_reversed and \
+                column_count == MAX_COLUMNS and \
+                column_family not in self.indexes.values():
+            requests = self._split(list(rowkeys), col_start, col_end)
+
+        def multiget(rowkeys, col_start, col_end):
+            def read(node):
+                # Not finding anything is an answer, not a failed read.
+                cf = self._get_column_family(column_family, node)
+                try:
+                    return cf.multiget(
+                        rowkeys,
+                        column_start=col_start,
+                        column_finish=col_end,
+                        column_reversed=column_reversed,
+                        column_count=column_count,
+                        **kwargs
+                    )
+                except NotFoundException:
+                    return {}
+            if self.hedge is not None:
+                return self.hedge.run(self.nodes, read)
+            return read(None)
+
+        timer_start = time.time()
+        if len(requests) == 1:
+            result = multiget(*requests[0])
+        else:
+            # Merge the sub-results in timestamp order.
+            result = {}
+            futures = [self._get_executor().submit(multiget, *request)
+                       for request in requests]
+            for future in futures:
+                for rowkey, columns in future.result().items():
+                    if rowkey in result:
+                        result[rowkey].update(columns)
+                    else:
+                        result[rowkey] = columns
+        elapsed = time.time() - timer_start
+        logger.debug("multiget in %.3fs", elapsed)
+        if self.metrics is not None:
+            self.metrics.observe('fetch_seconds', elapsed,
+                                 column_family=column_family)
+            self.metrics.observe('read_rowkeys', len(rowkeys),
+                                 column_family=column_family)
+        return result
+
+    def _bucket_end(self, rowkey):
+        # The (naive UTC) end of a bucket.
+        sensor_id, stamp = rowkey.rsplit(':', 1)
+        format = bucket_format(sensor_id)
+        return datetime.strptime(stamp, format) + bucket_delta(format)
+
+    def _is_closed(self, rowkey):
+        # A bucket is closed when no more data is expected for it.
+        return self._bucket_end(rowkey) + self.cache.closed_after <= \
+            datetime.utcnow()
+
+    def _fetch(self, column_family, rowkeys, col_start, col_end,
+               batch_size=None):
+        """Return a dict of (names, values) per rowkey that has columns.
+
+        Closed buckets are served from (and added to) the cache, if any.
+
+        """
+        columns = {}
+        if self.cache is None:
+            result = self._multiget(column_family, rowkeys, col_start,
+                                    col_end, batch_size)
+            for rowkey in result:
+                row = result[rowkey]
+                columns[rowkey] = row.keys(), row.values()
+            return columns
+
+        pending = self._local.pending.get(column_family, ())
+        uncached = []
+        missed = []
+        for rowkey in rowkeys:
+            if rowkey in pending or not self._is_closed(rowkey):
+                uncached.append(rowkey)
+                continue
+            entry = self.cache.get(column_family, rowkey)
+            if entry is None:
+                missed.append(rowkey)
+                continue
+            columns[rowkey] = entry
+
+        # Whole rows are fetched for the cache, the range is applied below.
+        # Closed buckets without data are cached too, so they aren't asked
+        # for again.
+        if missed:
+            result = self._multiget(column_family, missed, '', '', batch_size)
+            for rowkey in missed:
+                row = result.get(rowkey, {})
+                names = sorted(row)
+                values = [row[name] for name in names]
+                columns[rowkey] = self.cache.put(column_family, rowkey,
+                                                 names, values)
+
+        for rowkey, (names, values) in list(columns.items()):
+            if len(names) == 0:
+                del columns[rowkey]
+                continue
+            first = np.searchsorted(names, col_start, 'left')
+            last = np.searchsorted(names, col_end, 'right') if col_end \
+                else len(names)
+            if first == last:
+                del columns[rowkey]
+            else:
+                columns[rowkey] = (names[first:last].tolist(),
+                                   values[first:last].tolist())
+
+        if uncached:
+            result = self._multiget(column_family, uncached, col_start,
+                                    col_end, batch_size)
+            for rowkey in result:
+                row = result[rowkey]
+                columns[rowkey] = row.keys(), row.values()
+        return columns
+
+    def set_schema(self, column_family, fields):
+        """Set the types of the keys of a column family.
+
+        ``fields`` is a dict of cassandralib.schema.Field by key. read()
+        and its variants return a typed column for every key in it.
+
+        """
+        self.schemas[column_family] = dict(fields)
+
+    def set_codec(self, column_family, key, codec):
+        """Encode the values of a key with a codec, see cassandralib.codecs.
+
+        Values written before are still read correctly, so sensors can be
+        moved to a codec gradually. Without a schema entry, the key is read
+        as the codec's dtype, with its missing value.
+
+        """
+        self.codecs.setdefault(column_family, {})[key] = codec
+
+    def _to_frame(self, column_family, names, values, params=[],
+                  convert_values_to=None, ignore_rejected=None, where=None,
+                  output='pandas'):
+        codecs = self.codecs.get(column_family, {})
+        fields = self.schemas.get(column_family, {})
+        if convert_values_to in CONVERSIONS:
+            fields = dict(fields, value=CONVERSIONS[convert_values_to])
+        if ignore_rejected:
+            where = (where or Where()).excluding([REJECTED])
+
+        # Keys that are only needed for filtering are parsed, but dropped
+        # afterwards.
+        keys = params
+        if params and where is not None:
+            keys = set(params) | where.keys()
+
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.observe('read_columns', len(names),
+                            column_family=column_family)
+            metrics.observe('read_bytes',
+                            sum(map(len, names)) + sum(map(len, values)),
+                            column_family=column_family)
+
+        # Pivot the columns per key, indexed by datetime.
+        timer_start = time.time()
+        if self.decoder is not None and \
+                len(names) >= self.decoder.min_columns:
+            datetimes, columns, decoded = self.decoder.parse(
+                names, values, keys, codecs, fields
+            )
+        else:
+            datetimes, keys, rows, values = parse_columns(names, values,
+                                                          keys)
+            columns = dict(zip(keys, zip(rows, values)))
+            decoded = ()
+        if where is not None:
+            def convert(key, values):
+                if key in codecs and key not in decoded:
+                    values = codecs[key].decode(values)
+                return to_float(values)
+
+            keep = where.mask(len(datetimes), columns, convert)
+            if not keep.all():
+                # Renumber the rows of every key to the timestamps kept.
+                positions = np.cumsum(keep) - 1
+                for key, (key_rows, key_values) in columns.items():
+                    kept = keep[key_rows]
+                    columns[key] = (positions[key_rows[kept]],
+                                    key_values[kept])
+                datetimes = datetimes[keep]
+            if metrics is not None:
+                metrics.observe('filtered_rows', len(keep) - len(datetimes),
+                                column_family=column_family)
+            if params:
+                columns = dict((key, columns[key]) for key in columns
+                               if key in params)
+        elapsed = time.time() - timer_start
+        logger.debug("flattened in %.3fs", elapsed)
+        if metrics is not None:
+            metrics.observe('parse_seconds', elapsed,
+                            column_family=column_family)
+
+        # Decode keys that have a codec and build a typed array for every
+        # key in the schema (or convert_values_to). Keys with only a codec
+        # keep its dtype and missing value. Other keys are kept in their
+        # current (Cassandra) form, missing values are None.
+        timer_start = time.time()
+        data_flat = {}
+        for key, (key_rows, key_values) in columns.items():
+            if key in codecs and key not in decoded:
+                key_values = codecs[key].decode(key_values)
+            if key in fields:
+                column = fields[key].column(len(datetimes), key_rows,
+                                            key_values)
+            elif key in codecs:
+                column = np.empty(len(datetimes), dtype=codecs[key].dtype)
+                column.fill(codecs[key].missing)
+                column[key_rows] = key_values
+            else:
+                column = np.empty(len(datetimes), dtype=object)
+                column[key_rows] = key_values
+            data_flat[key] = column
+        elapsed = time.time() - timer_start
+        logger.debug("converted in %.3fs", elapsed)
+        if metrics is not None:
+            metrics.observe('convert_seconds', elapsed,
+                            column_family=column_family)
+
+        # And create the Pandas DataFrame (or another output).
+        timer_start = time.time()
+        if output != 'pandas':
+            result = to_output(datetimes, data_flat, output)
+        else:
+            index = pd.DatetimeIndex(datetimes)
+            if len(index) > 0:
+                index = index.tz_localize(INTERNAL_TIMEZONE)
+            result = pd.DataFrame(data=data_flat, index=index)
+        elapsed = time.time() - timer_start
+        logger.debug("pandafied in %.3fs", elapsed)
+        if metrics is not None:
+            metrics.observe('frame_seconds', elapsed,
+                            column_family=column_family)
+        return result
+
+    def read(self, column_family, sensor_id, start, end, params=[],
+             convert_values_to=None, ignore_rejected=None, resample=None,
+             aggregate=('mean',), page_size=DEFAULT_PAGE_SIZE, where=None,
+             output='pandas'):
+        """Return the data of a sensor between start and end.
+
+        Only the timestamps that meet the conditions of ``where`` (a
+        cassandralib.filters.Where) are returned. If the column family
+        has an index (see add_index()), start and end may be None.
+
+        If ``resample`` is given (a fixed frequency like '15min' or 'D'),
+        the data is read page by page and reduced to the ``aggregate``
+        (one or more of count, sum, min, max and mean) per period of
+        every key in ``params``, or every key except 'flag'. The full
+        resolution data is never held in memory at once. If there is a
+        rollup whose periods fit the requested ones and the range, the
+        coarsest such rollup is read instead of the raw data.
+
+        ``output`` is 'pandas' for a DataFrame, or one of the other forms
+        of cassandralib.output, which skip building the DataFrame.
+
+        """
+        self._check_range(start, end)
+        check_output(output)
+        if (start is None or end is None) and \
+                column_family not in self.indexes:
+            return frame_to_output(pd.DataFrame(), output)
+
+        if resample is not None:
+            rollup = None
+            if where is None and start is not None and end is not None:
+                rollup = self._find_rollup(column_family, start, end,
+                                           resample, ignore_rejected)
+            if rollup is not None:
+                return frame_to_output(self._read_rollup(
+                    rollup, sensor_id, start, end, params, resample,
+                    aggregate
+                ), output)
+            frames = [df for df in self.iter_read(
+                column_family, sensor_id, start, end, params=params,
+                ignore_rejected=ignore_rejected, page_size=page_size,
+                resample=resample, aggregate=aggregate, where=where
+            ) if len(df)]
+            return frame_to_output(pd.concat(frames) if frames else
+                              pd.DataFrame(), output)
+
+        rowkeys = list(self._buckets(column_family, [sensor_id], start, end))
 
         # If no Cassandra rows are in requested date range, return nothing.
         if len(rowkeys) == 0:
-            return pd.DataFrame()
+            return frame_to_output(pd.DataFrame(), output)
+
+        col_start, col_end = self._column_range(start, end)
+
+        names = []
+        values = []
+
+        # Collect all columns into two flat lists; list.extend is a lot
+        # cheaper than touching every column in Python.
+        columns = self._fetch(column_family, rowkeys, col_start, col_end)
+        for rowkey in columns:
+            names.extend(columns[rowkey][0])
+            values.extend(columns[rowkey][1])
+
+        return self._to_frame(column_family, names, values, params,
+                              convert_values_to, ignore_rejected, where,
+                              output)
+
+    def read_many(self, column_family, sensor_ids, start, end, params=[],
+                  convert_values_to=None, ignore_rejected=None,
+                  batch_size=None, as_dict=False, where=None,
+                  output='pandas'):
+        """Read the same time range for several sensors at once.
+
+        The bucket rows of all sensors are fetched with one multiget, which
+        pycassa sends in batches of ``batch_size`` rows (its own default
+        if None). Returns a DataFrame with a (sensor_id, key) column
+        MultiIndex, or a dict of DataFrames by sensor_id if ``as_dict``.
+        With another ``output`` than 'pandas', always a dict by sensor_id.
+
+        """
+        self._check_range(start, end)
+        check_output(output)
+        if (start is None or end is None) and \
+                column_family not in self.indexes:
+            return {} if as_dict or output != 'pandas' else pd.DataFrame()
+
+        sensor_ids = list(sensor_ids)
+        sensors = self._buckets(column_family, sensor_ids, start, end)
+
+        columns = dict((sensor_id, ([], [])) for sensor_id in sensor_ids)
+        if sensors:
+            col_start, col_end = self._column_range(start, end)
+            result = self._fetch(column_family, list(sensors), col_start,
+                                 col_end, batch_size)
+            for rowkey in result:
+                names, values = columns[sensors[rowkey]]
+                names.extend(result[rowkey][0])
+                values.extend(result[rowkey][1])
+
+        frames = dict(
+            (sensor_id, self._to_frame(column_family, names, values, params,
+                                       convert_values_to, ignore_rejected,
+                                       where, output))
+            for sensor_id, (names, values) in columns.items()
+        )
+        return _combine(sensor_ids, frames, as_dict, output)
+
+    def read_latest(self, column_family, sensor_ids, n=1, params=[],
+                    convert_values_to=None, end=None, max_buckets=10,
+                    as_dict=False, output='pandas'):
+        """Return the last ``n`` timestamps of sensors before end (now).
+
+        Instead of scanning a range, the bucket row holding ``end`` is
+        read backwards with a small column count, for all sensors with
+        one multiget. Earlier buckets are only read for sensors that
+        don't have ``n`` timestamps yet, at most ``max_buckets`` back.
+        Returns the data like read_many(), with ``output`` like read().
+
+        If the store has a cassandralib.cache.LatestCache, reads up to
+        now are served from (and added to) it.
 
-        col_start = start.astimezone(INTERNAL_TIMEZONE) \
-            .strftime(COLNAME_FORMAT_MS)
-        col_end = end.astimezone(INTERNAL_TIMEZONE).strftime(COLNAME_FORMAT_MS)
+        """
+        check_output(output)
+        use_cache = self.latest is not None and end is None
+        if end is None:
+            end = datetime.utcnow().replace(tzinfo=INTERNAL_TIMEZONE)
+        self._check_range(None, end)
+        end = end.astimezone(INTERNAL_TIMEZONE)
+        until = end.strftime(COLNAME_FORMAT_MS)
 
-        data = {}
-        keys = []
+        sensor_ids = list(sensor_ids)
+        columns = {}
+        found = {}
+        # The bucket, the number of buckets walked back and the column
+        # count to read next, by sensor. The count starts at a guess of a
+        # few keys per timestamp and is doubled while it isn't enough.
+        todo = {}
+        for sensor_id in sensor_ids:
+            if use_cache:
+                entry = self.latest.get(column_family, sensor_id, n, until)
+                if entry is not None:
+                    columns[sensor_id] = entry
+                    continue
+            columns[sensor_id] = ([], [])
+            found[sensor_id] = 0
+            todo[sensor_id] = (bucket_start(end, bucket_format(sensor_id)),
+                               0, 4 * (n + 1))
 
-        try:
-            timer_start = datetime.now()
-            result = self._get_column_family(column_family).multiget(
-                rowkeys,
+        while todo:
+            groups = {}
+            for sensor_id, (stamp, walked, count) in todo.items():
+                rowkey = stamp.strftime(sensor_id + ':' +
+                                        bucket_format(sensor_id))
+                groups.setdefault(count, {})[rowkey] = sensor_id
+            for count, sensors in groups.items():
+                result = self._multiget(column_family, list(sensors), until,
+                                        '', column_reversed=True,
+                                        column_count=count)
+                for rowkey, sensor_id in sensors.items():
+                    stamp, walked, count = todo.pop(sensor_id)
+                    row = result.get(rowkey, {})
+                    row_names = sorted(row, reverse=True)
+                    # Take the columns of the newest timestamps still
+                    # needed. The oldest timestamp of a full slice may be
+                    # cut off, so it only counts if a yet older one shows.
+                    need = n - found[sensor_id]
+                    stamps = []
+                    taken = len(row_names)
+                    for i, name in enumerate(row_names):
+                        name_stamp = name.split(COLNAME_SEPERATOR, 1)[0]
+                        if not stamps or stamps[-1] != name_stamp:
+                            if len(stamps) == need:
+                                taken = i
+                                break
+                            stamps.append(name_stamp)
+                    if taken == len(row_names) and len(row) >= count:
+                        todo[sensor_id] = (stamp, walked, count * 2)
+                        continue
+                    names, values = columns[sensor_id]
+                    names.extend(row_names[:taken])
+                    values.extend(row[name] for name in row_names[:taken])
+                    found[sensor_id] += len(stamps)
+                    if found[sensor_id] < n and walked + 1 < max_buckets:
+                        format = bucket_format(sensor_id)
+                        todo[sensor_id] = (stamp - bucket_delta(format),
+                                           walked + 1, count)
+
+        frames = {}
+        for sensor_id in sensor_ids:
+            names, values = columns[sensor_id]
+            if use_cache and found.get(sensor_id) == n:
+                self.latest.put(column_family, sensor_id, n, names, values)
+            frames[sensor_id] = self._to_frame(column_family, names, values,
+                                               params, convert_values_to,
+                                               output=output)
+        return _combine(sensor_ids, frames, as_dict, output)
+
+    def read_since(self, column_family, sensor_id, cursor=None, start=None,
+                   params=[], convert_values_to=None, ignore_rejected=None,
+                   output='pandas'):
+        """Return the columns of a sensor after a cursor, and a new cursor.
+
+        Pass the cursor of the previous call to get only what has been
+        written since, or None to start at ``start`` (now if None). The
+        cursor is opaque; it's the last column name returned, so reads
+        roll over to the next bucket by themselves.
+
+        Columns are returned by timestamp, not by the time they were
+        written: a timestamp before the cursor that is written later is
+        not returned, and neither is a key of the last timestamp that
+        sorts before the last key returned. ``output`` is like read().
+
+        """
+        frames, cursors = self.read_since_many(
+            column_family, {sensor_id: cursor}, start, params,
+            convert_values_to, ignore_rejected, output=output
+        )
+        return frames[sensor_id], cursors[sensor_id]
+
+    def read_since_many(self, column_family, cursors, start=None, params=[],
+                        convert_values_to=None, ignore_rejected=None,
+                        batch_size=None, output='pandas'):
+        """Like read_since(), for a dict of cursors by sensor_id.
+
+        Returns a dict of DataFrames and a dict of new cursors, both by
+        sensor_id. Sensors with cursors in the same minute are read with
+        one multiget from the earliest of them, from their bucket up to
+        the current one (or the last one in the index). Cursors move past
+        the buckets that were read and are closed (CLOSED_AFTER after
+        their end), so a silent sensor doesn't cost a rowkey per elapsed
+        bucket on every call.
+
+        """
+        now = datetime.utcnow().replace(tzinfo=INTERNAL_TIMEZONE)
+        self._check_range(start, None)
+        check_output(output)
+        initial = self._column_range(start or now, None)[0]
+
+        cursors = dict((sensor_id, cursor or initial)
+                       for sensor_id, cursor in cursors.items())
+        groups = {}
+        for sensor_id, cursor in cursors.items():
+            groups.setdefault(cursor[:16], []).append(sensor_id)
+
+        columns = dict((sensor_id, ([], [])) for sensor_id in cursors)
+        # The end of the last closed bucket read, by sensor_id.
+        closed = {}
+        end = None if column_family in self.indexes else now
+        for sensor_ids in groups.values():
+            col_start = min(cursors[sensor_id] for sensor_id in sensor_ids)
+            since = strptime(col_start.split(COLNAME_SEPERATOR, 1)[0]) \
+                .replace(tzinfo=INTERNAL_TIMEZONE)
+            sensors = self._buckets(column_family, sensor_ids, since, end)
+            if not sensors:
+                continue
+            result = self._multiget(column_family, list(sensors), col_start,
+                                    '', batch_size)
+            for rowkey, sensor_id in sensors.items():
+                bucket_end = self._bucket_end(rowkey)
+                if bucket_end + CLOSED_AFTER <= now.replace(tzinfo=None):
+                    closed[sensor_id] = max(
+                        closed.get(sensor_id, ''),
+                        bucket_end.strftime(COLNAME_FORMAT_MS)
+                    )
+            for rowkey in sorted(result):
+                sensor_id = sensors[rowkey]
+                cursor = cursors[sensor_id]
+                names, values = columns[sensor_id]
+                row = result[rowkey]
+                for name in row:
+                    if name > cursor:
+                        names.append(name)
+                        values.append(row[name])
+
+        frames = {}
+        for sensor_id, (names, values) in columns.items():
+            cursors[sensor_id] = max([cursors[sensor_id]] + names +
+                                     [closed.get(sensor_id, '')])
+            frames[sensor_id] = self._to_frame(column_family, names, values,
+                                               params, convert_values_to,
+                                               ignore_rejected, output=output)
+        return frames, cursors
+
+    def iter_read(self, column_family, sensor_id, start, end, params=[],
+                  convert_values_to=None, ignore_rejected=None,
+                  page_size=DEFAULT_PAGE_SIZE, resample=None,
+                  aggregate=('mean',), where=None, output='pandas',
+                  read_consistency_level=None):
+        """Read like read(), but yield the result one page at a time.
+
+        Every bucket row is fetched in slices of ``page_size`` columns and
+        a DataFrame is yielded for about every ``page_size`` columns, so
+        memory use doesn't depend on the length of the time range. A page
+        is only cut between timestamps, never in the middle of one.
+
+        With ``resample``, every page is folded into aggregates as in
+        read(), and a frame is yielded with the periods that are complete.
+        Pages are yielded in the form of ``output``, like read().
+        ``read_consistency_level`` overrides that of the store.
+
+        """
+        self._check_range(start, end)
+        check_output(output)
+        if (start is None or end is None) and \
+                column_family not in self.indexes:
+            return
+
+        if resample is not None:
+            aggregator = Aggregator(resample, aggregate, params or None)
+            for df in self.iter_read(
+                    column_family, sensor_id, start, end, params, None,
+                    ignore_rejected, page_size, where=where,
+                    read_consistency_level=read_consistency_level):
+                yield frame_to_output(aggregator.add(df), output)
+            yield frame_to_output(aggregator.finish(), output)
+            return
+
+        cf = self._get_column_family(column_family)
+        col_start, col_end = self._column_range(start, end)
+        # Buckets of one sensor sort by time.
+        rowkeys = sorted(self._buckets(column_family, [sensor_id], start,
+                                       end))
+        if self.metrics is not None:
+            self.metrics.observe('read_rowkeys', len(rowkeys),
+                                 column_family=column_family)
+
+        kwargs = {}
+        if read_consistency_level is not None:
+            kwargs['read_consistency_level'] = read_consistency_level
+        for rowkey in rowkeys:
+            names = []
+            values = []
+            stamp = None
+            columns = cf.xget(
+                rowkey,
                 column_start=col_start,
                 column_finish=col_end,
-                column_count=MAX_COLUMNS
+                buffer_size=page_size,
+                **kwargs
             )
-            for rowkey in result:
-                for col_name in result[rowkey]:
-                    bits = col_name.split(COLNAME_SEPERATOR)
-                    if (len(bits) > 1):
-                        dt = strptime(bits[0])
-                        key = col_name[len(bits[0]) + 1:]
-                        if not params or key in params:
-                            if key not in keys:
-                                keys.append(key)
-                            if not dt in data:
-                                data[dt] = {}
-                            data[dt][key] = result[rowkey][col_name]
-            logger.debug("multiget in %s", datetime.now() - timer_start)
-        except NotFoundException:
-            pass
-
-        # Flatten the dataset by key.
-        # Missing values are converted to None.
-        timer_start = datetime.now()
-        datetimes = sorted(data.keys())
-        notrejected = list(datetimes)
-        data_flat = {key: [] for key in keys}
-        for dt in datetimes:
-            row = data[dt]
-            flag = row.get("flag")
-            if ignore_rejected and flag == "6":
-                notrejected.remove(dt)
+            for name, value in columns:
+                if len(names) >= page_size:
+                    if stamp is None:
+                        stamp = names[-1].split(COLNAME_SEPERATOR, 1)[0]
+                    if name.split(COLNAME_SEPERATOR, 1)[0] != stamp:
+                        yield self._to_frame(column_family, names, values,
+                                             params, convert_values_to,
+                                             ignore_rejected, where, output)
+                        names = []
+                        values = []
+                        stamp = None
+                names.append(name)
+                values.append(value)
+            if names:
+                yield self._to_frame(column_family, names, values, params,
+                                     convert_values_to, ignore_rejected,
+                                     where, output)
+
+    def add_rollup(self, column_family, resample, rollup_column_family,
+                   ignore_rejected=None):
+        """Maintain per-period aggregates of column_family.
+
+        From now on, commit() updates the count, sum, min and max per
+        ``resample`` period (a fixed frequency, like 'H' or 'D') of the
+        periods written to, in ``rollup_column_family``. Use
+        build_rollups() for existing data. read() uses the rollup for the
+        same ``ignore_rejected``.
+
+        Updates are incremental. If everything written to a period is
+        newer than the data it already has, the new data is merged into
+        its stored aggregates; otherwise the period is recomputed from
+        the raw data. A rollup whose periods are made up of those of a
+        finer rollup (with the same ``ignore_rejected``) is computed from
+        that rollup. Both are read at QUORUM.
+
+        Rollups only see writes made through this store, and a sensor
+        must be written by one thread or process at a time.
+
+        """
+        rollups = self.rollups.setdefault(column_family, [])
+        rollups.append(Rollup(rollup_column_family, resample,
+                              ignore_rejected))
+        rollups.sort(key=lambda rollup: rollup.freq)
+
+    def _find_rollup(self, column_family, start, end, resample,
+                     ignore_rejected):
+        # The coarsest rollup whose periods add up to the requested ones
+        # and line up with the range.
+        freq = pd.tseries.frequencies.to_offset(resample).nanos
+        stamps = [pd.Timestamp(start).value, pd.Timestamp(end).value]
+        for rollup in reversed(self.rollups.get(column_family, [])):
+            if rollup.ignore_rejected != bool(ignore_rejected):
                 continue
-            else:
-                for key in keys:
-                    value = row.get(key)
-                    data_flat[key].append(value)
-        # index should align with keys values.
-        datetimes = notrejected
-        logger.debug("flattened in %s", datetime.now() - timer_start)
-
-        # Convert values to an appropriate Numpy array type, if requested.
-        # Unknown types are kept in their current (Cassandra) form.
-        timer_start = datetime.now()
-        if datetimes and convert_values_to is not None and 'value' in data_flat:
-            dtype_map = {
-                'float': np.float32,
-                'integer': np.int32
-            }
-            dtype = dtype_map.get(convert_values_to)
-            if dtype is not None:
-                # There's a bug in numpy.genfromtxt causing a list of length 1
-                # to produce a 0-dim array. Appending and removing a dummy
-                # value resolves this.
-                length = len(data_flat['value'])
-                data_flat['value'].append('dummy')
-                data_flat['value'] = \
-                    np.genfromtxt(data_flat['value'], dtype=dtype)[:length]
-        logger.debug("converted in %s", datetime.now() - timer_start)
-
-        # And create the Pandas DataFrame.
-        timer_start = datetime.now()
-        result = pd.DataFrame(data=data_flat, index=datetimes)
-        logger.debug("pandafied in %s", datetime.now() - timer_start)
-        if len(datetimes) > 0:
-            result.tz_localize(INTERNAL_TIMEZONE, copy=False)
-        return result
+            if freq % rollup.freq == 0 and \
+                    all(stamp % rollup.freq == 0 for stamp in stamps):
+                return rollup
+
+    def _rollup_source(self, column_family, rollup):
+        # The coarsest finer rollup whose periods add up to those of
+        # rollup, which it is computed from; None for a base rollup.
+        for finer in reversed(self.rollups[column_family]):
+            if finer.freq < rollup.freq and rollup.freq % finer.freq == 0 \
+                    and finer.ignore_rejected == rollup.ignore_rejected:
+                return finer
+
+    def _read_rollup(self, rollup, sensor_id, start, end, params, resample,
+                     aggregate):
+        df = self.read(rollup.column_family, sensor_id, start, end)
+        aggregator = Aggregator(resample, aggregate, params or None)
+        frames = [aggregator.add_partial(
+            rollup.from_columns(df, params or None)
+        ), aggregator.finish()]
+        frames = [frame for frame in frames if len(frame)]
+        return pd.concat(frames) if frames else pd.DataFrame()
+
+    def _read_partials(self, rollup, sensor_id, start, end):
+        # The stored partial aggregates of the periods between start and
+        # end (ns), read at QUORUM.
+        start, end = [pd.Timestamp(stamp, tz=INTERNAL_TIMEZONE)
+                      .to_pydatetime() for stamp in (start, end)]
+        result = self._multiget(
+            rollup.column_family,
+            list(self._buckets(rollup.column_family, [sensor_id], start,
+                               end)),
+            *self._column_range(start, end),
+            read_consistency_level=pycassa.ConsistencyLevel.QUORUM
+        )
+        names = []
+        values = []
+        for rowkey in sorted(result):
+            names.extend(result[rowkey].keys())
+            values.extend(result[rowkey].values())
+        if not names:
+            return pd.DataFrame()
+        return rollup.from_columns(
+            self._to_frame(rollup.column_family, names, values)
+        )
+
+    def _build_rollup(self, column_family, rollup, sensor_id, start, end,
+                      read_consistency_level=None):
+        # Widen the range to whole periods.
+        start = pd.Timestamp(start).value
+        start -= start % rollup.freq
+        end = pd.Timestamp(end).value
+        end += -end % rollup.freq
+        frames = self.iter_read(
+            column_family, sensor_id,
+            pd.Timestamp(start, tz=INTERNAL_TIMEZONE).to_pydatetime(),
+            pd.Timestamp(end, tz=INTERNAL_TIMEZONE).to_pydatetime(),
+            ignore_rejected=rollup.ignore_rejected,
+            resample=rollup.resample, aggregate=PARTIALS,
+            read_consistency_level=read_consistency_level
+        )
+        for df in frames:
+            if len(df):
+                self.write_frame(rollup.column_family, sensor_id,
+                                 rollup.to_columns(df))
+
+    def build_rollups(self, column_family, sensor_id, start, end):
+        """(Re)compute the rollups of a sensor between start and end."""
+        for rollup in self.rollups.get(column_family, []):
+            self._build_rollup(column_family, rollup, sensor_id, start, end)
+            self.commit(rollup.column_family)
+
+    def _last_existing(self, column_family, sensor_id, start, end):
+        # The timestamp (ns) of the last column between start and end
+        # (ns), or None if there is none.
+        start, end = [pd.Timestamp(stamp, tz=INTERNAL_TIMEZONE)
+                      .to_pydatetime() for stamp in (start, end)]
+        rowkeys = list(self._buckets(column_family, [sensor_id], start, end))
+        if not rowkeys:
+            return None
+        col_start, col_end = self._column_range(start, end)
+        result = self._multiget(
+            column_family, rowkeys, col_end, col_start,
+            column_reversed=True, column_count=1,
+            read_consistency_level=pycassa.ConsistencyLevel.QUORUM
+        )
+        names = [name for columns in result.values() for name in columns]
+        if names:
+            stamp = max(names).split(COLNAME_SEPERATOR, 1)[0]
+            return _microseconds(stamp) * 1000
+
+    def _mark_written(self, column_family, sensor_id, stamps, data):
+        # Remember what is written to a sensor and, before it is, the last
+        # existing timestamp of every new period of the base rollups.
+        data_written, last_existing = self._local.written \
+            .setdefault(column_family, {}) \
+            .setdefault(sensor_id, ([], {}))
+        data_written.append(data)
+        stamps = np.asarray(stamps, dtype=np.int64)
+        for rollup in self.rollups[column_family]:
+            if self._rollup_source(column_family, rollup) is not None:
+                continue
+            last = last_existing.setdefault(rollup.freq, {})
+            periods = [period for period in
+                       np.unique(stamps - stamps % rollup.freq).tolist()
+                       if period not in last]
+            if not periods:
+                continue
+            # One read bounds the last existing timestamp of all new
+            # periods; if that doesn't rule out an overlap, read each.
+            bound = self._last_existing(column_family, sensor_id,
+                                        periods[0],
+                                        periods[-1] + rollup.freq)
+            if bound is None or bound < stamps.min():
+                last.update((period, bound) for period in periods)
+                continue
+            for period in periods:
+                last[period] = self._last_existing(
+                    column_family, sensor_id, period, period + rollup.freq
+                )
+
+    def _update_rollups(self, column_family):
+        written = self._local.written.pop(column_family, {})
+        for sensor_id, (data_written, last_existing) in written.items():
+            df = _written_frame(data_written)
+            periods = {}
+            for rollup in self.rollups[column_family]:
+                source = self._rollup_source(column_family, rollup)
+                if source is None:
+                    periods[rollup] = self._merge_rollup(
+                        column_family, rollup, sensor_id, df,
+                        last_existing.get(rollup.freq, {})
+                    )
+                else:
+                    stamps = periods[source]
+                    periods[rollup] = np.unique(stamps - stamps % rollup.freq)
+                    self._derive_rollup(source, rollup, sensor_id,
+                                        periods[rollup])
+                self.commit(rollup.column_family)
+
+    def _merge_rollup(self, column_family, rollup, sensor_id, df, last):
+        # Update the periods of a base rollup that df was written to, and
+        # return them (in ns). ``last`` has the last timestamp each of them
+        # had before.
+        stamps = nanoseconds(df.index)
+        periods = stamps - stamps % rollup.freq
+        firsts = pd.Series(stamps).groupby(periods).min()
+        appended = [period for period, first in firsts.items()
+                    if period in last and
+                    (last[period] is None or last[period] < first)]
+        if appended:
+            new = df[np.isin(periods, appended)]
+            if rollup.ignore_rejected and 'flag' in new.columns:
+                new = new[(new['flag'].astype(str) != REJECTED).values]
+            partials = [self._read_partials(rollup, sensor_id, appended[0],
+                                            appended[-1] + rollup.freq)]
+            if len(partials[0]):
+                partials[0] = partials[0][np.isin(partials[0].index,
+                                                  appended)]
+            if len(new):
+                partials.append(
+                    Aggregator(rollup.resample, PARTIALS).partial(new)
+                )
+            partials = [partial for partial in partials if len(partial)]
+            if partials:
+                self.write_frame(rollup.column_family, sensor_id,
+                                 rollup.from_partial(combine(partials)))
+
+        # Recompute the other periods, a run of consecutive ones at once.
+        appended = set(appended)
+        rebuilt = np.array([period for period in firsts.index.tolist()
+                            if period not in appended], dtype=np.int64)
+        breaks = np.flatnonzero(np.diff(rebuilt) != rollup.freq) + 1
+        for run in np.split(rebuilt, breaks) if len(rebuilt) else []:
+            start = pd.Timestamp(int(run[0]), tz=INTERNAL_TIMEZONE)
+            end = pd.Timestamp(int(run[-1]) + rollup.freq,
+                               tz=INTERNAL_TIMEZONE)
+            self._build_rollup(column_family, rollup, sensor_id,
+                               start.to_pydatetime(), end.to_pydatetime(),
+                               pycassa.ConsistencyLevel.QUORUM)
+        return firsts.index.values.astype(np.int64)
+
+    def _derive_rollup(self, source, rollup, sensor_id, periods):
+        # Recompute periods (ns) of rollup from the finer rollup source.
+        breaks = np.flatnonzero(np.diff(periods) != rollup.freq) + 1
+        for run in np.split(periods, breaks) if len(periods) else []:
+            partial = self._read_partials(source, sensor_id, int(run[0]),
+                                          int(run[-1]) + rollup.freq)
+            if len(partial):
+                stamps = np.asarray(partial.index, dtype=np.int64)
+                partial.index = stamps - stamps % rollup.freq
+                self.write_frame(rollup.column_family, sensor_id,
+                                 rollup.from_partial(combine([partial])))
+
+    def add_index(self, column_family, index_column_family):
+        """Keep track of the buckets of column_family that have data.
+
+        ``index_column_family`` gets a row per sensor with the first and
+        last column of each of its buckets, which commit() keeps up to
+        date. read(), read_many() and iter_read() then only fetch buckets
+        that have data in the range, and accept None as start or end for
+        an open-ended range. Use build_index() for existing data.
+
+        The first and last columns are written with their (negated)
+        timestamp as Cassandra write timestamp, so the lowest first and
+        the highest last win whichever process writes them.
+
+        """
+        self.indexes[column_family] = index_column_family
+
+    def build_index(self, column_family, sensor_id, start, end):
+        """Add the buckets of a sensor between start and end to the index.
+
+        Only the first and last column of every bucket are read.
+
+        """
+        cf = self._get_column_family(column_family)
+        for rowkey in self._rowkeys(sensor_id, start, end):
+            try:
+                first = cf.get(rowkey, column_count=1)
+                last = cf.get(rowkey, column_count=1, column_reversed=True)
+            except NotFoundException:
+                continue
+            self._mark_bounds(column_family, sensor_id,
+                              rowkey.rsplit(':', 1)[1],
+                              list(first)[0], list(last)[0])
+        self._write_index(column_family)
+
+    def _mark_bounds(self, column_family, sensor_id, bucket, first, last):
+        # Remember the first and last column name written to a bucket.
+        first = first.split(COLNAME_SEPERATOR, 1)[0]
+        last = last.split(COLNAME_SEPERATOR, 1)[0]
+        bounds = self._local.bounds.setdefault(column_family, {}) \
+            .setdefault(sensor_id, {})
+        if bucket in bounds:
+            first = min(first, bounds[bucket][0])
+            last = max(last, bounds[bucket][1])
+        bounds[bucket] = (first, last)
+
+    def _write_index(self, column_family):
+        bounds = self._local.bounds.pop(column_family, {})
+        if not bounds:
+            return
+        batch = self._get_column_family(
+            self.indexes[column_family]
+        ).batch(queue_size=self.queue_size)
+        for sensor_id, buckets in bounds.items():
+            for bucket, (first, last) in buckets.items():
+                # Cassandra keeps the value with the highest timestamp.
+                batch.insert(
+                    sensor_id,
+                    {bucket + COLNAME_SEPERATOR + 'first': first},
+                    timestamp=-_microseconds(first)
+                )
+                batch.insert(
+                    sensor_id,
+                    {bucket + COLNAME_SEPERATOR + 'last': last},
+                    timestamp=_microseconds(last)
+                )
+        batch.send()
+
+    def _count(self, column_family, columns):
+        buffered = self._local.buffered
+        buffered[column_family] = buffered.get(column_family, 0) + columns
+
+    def _touch(self, column_family, rowkey):
+        # Keep the cache from serving a row that is being written to.
+        if self.cache is not None:
+            self._local.pending.setdefault(column_family, set()).add(rowkey)
+            self.cache.invalidate(column_family, rowkey)
 
     def write_row(self, column_family, sensor_id, timestamp, row):
         ts_int = timestamp.astimezone(INTERNAL_TIMEZONE)
         key = ts_int.strftime(sensor_id + ':' + bucket_format(sensor_id))
         stamp = ts_int.strftime(COLNAME_FORMAT_MS)
-        self._get_batch(column_family).insert(key, dict(
-            ("%s%s%s" % (stamp, COLNAME_SEPERATOR, k), str(v))
-            for k, v in row.iteritems()
-        ))
+        self._touch(column_family, key)
+        if column_family in self.rollups:
+            self._mark_written(column_family, sensor_id,
+                               [pd.Timestamp(ts_int).value], (ts_int, row))
+        codecs = self.codecs.get(column_family, {})
+        columns = dict(
+            ("%s%s%s" % (stamp, COLNAME_SEPERATOR, k),
+             codecs[k].encode_one(v) if k in codecs else str(v))
+            for k, v in row.items()
+        )
+        self._get_batch(column_family).insert(key, columns)
+        if column_family in self.indexes:
+            self._mark_bounds(column_family, sensor_id,
+                              ts_int.strftime(bucket_format(sensor_id)),
+                              stamp, stamp)
+        if self.metrics is not None:
+            self._count(column_family, len(row))
+        if self.latest is not None:
+            self.latest.update(column_family, sensor_id, list(columns),
+                               list(columns.values()))
+
+    def write_frame(self, column_family, sensor_id, df,
+                    chunk_size=DEFAULT_PAGE_SIZE):
+        """Write every row of a DataFrame, like write_row() does for one.
+
+        The index must be a timezone aware DatetimeIndex, the columns are
+        the keys. Rowkeys and column names are formatted for the whole
+        frame at once, and the columns are inserted per bucket row in
+        chunks of at most ``chunk_size``. Missing values aren't written.
+
+        """
+        if len(df) == 0:
+            return
+        assert df.index.tz is not None, \
+            "DataFrame index must be timezone aware"
+
+        if column_family in self.rollups:
+            self._mark_written(column_family, sensor_id,
+                               nanoseconds(df.index), df)
+
+        # The values of a timezone aware index are UTC.
+        datetimes = np.asarray(df.index.values, dtype='datetime64[us]')
+        unit = BUCKET_UNITS[bucket_format(sensor_id)]
+        buckets, rowkeys = pd.factorize(
+            datetimes.astype('datetime64[%s]' % unit).view('i8')
+        )
+        rowkeys = np.asarray(rowkeys).view('datetime64[%s]' % unit)
+        rowkeys = np.datetime_as_string(rowkeys, unit=unit).tolist()
+        stamps = _column_prefixes(datetimes)
+        if column_family in self.indexes:
+            grouped = pd.Series(stamps).groupby(buckets)
+            for bucket, first, last in zip(rowkeys, grouped.min(),
+                                           grouped.max()):
+                self._mark_bounds(column_family, sensor_id, bucket, first,
+                                  last)
+        rowkeys = [sensor_id + ':' + rowkey for rowkey in rowkeys]
+
+        codecs = self.codecs.get(column_family, {})
+        codes, names, values = [], [], []
+        for column in df.columns:
+            series = df[column]
+            notnull = series.notnull().values
+            codes.append(buckets[notnull])
+            names.append(np.char.add(stamps[notnull], '%s' % column))
+            if column in codecs:
+                encoded = np.empty(notnull.sum(), dtype=object)
+                encoded[:] = codecs[column].encode(series.values[notnull])
+                values.append(encoded)
+            else:
+                values.append(_to_text(series.values[notnull]))
+        codes = np.concatenate(codes)
+        names = np.concatenate(names)
+        values = np.concatenate(values)
+        if self.metrics is not None:
+            self._count(column_family, len(names))
+        size = 0 if self.latest is None else \
+            self.latest.size(column_family, sensor_id)
+        if size:
+            # Only the last timestamps can change the entry.
+            last = names >= np.unique(stamps)[-size:][0]
+            self.latest.update(column_family, sensor_id,
+                               names[last].tolist(), values[last].tolist())
+
+        # Group the columns by bucket row.
+        order = np.argsort(codes, kind='mergesort')
+        bounds = np.cumsum(np.bincount(codes, minlength=len(rowkeys)))
+
+        batch = self._get_batch(column_family)
+        first = 0
+        for key, last in zip(rowkeys, bounds.tolist()):
+            self._touch(column_family, key)
+            for i in range(first, last, chunk_size):
+                index = order[i:min(i + chunk_size, last)]
+                batch.insert(key, dict(zip(names[index].tolist(),
+                                           values[index].tolist())))
+            first = last
+
+    def rebucket(self, column_family, sensor_id, start, end, format,
+                 delete_old=False, page_size=DEFAULT_PAGE_SIZE):
+        """Move the data of a sensor to rows in another bucket format.
+
+        All columns between start and end are copied, a page at a time,
+        from the rows of the current bucket format to rows in ``format``.
+        The sensor is then registered with the new format, and after the
+        ``max_age`` of the registry (see BucketFormats), when every
+        process uses the new format, the old rows are copied once more to
+        pick up columns written in the meantime. Since the copy is
+        complete before the switch, reads keep working throughout. With a
+        registry that isn't shared, other processes have to register the
+        new format themselves.
+
+        The format is switched for all data of the sensor, so the range
+        must hold all of it: a ValueError is raised if there is data
+        outside of it. If the column family has an index, start and end
+        may be None, and its buckets are checked; without one, only the
+        buckets around the range are.
+
+        If ``delete_old``, the copied columns are removed from the old rows
+        in the second pass.
+
+        """
+        self._check_range(start, end)
+        old_format = bucket_format(sensor_id)
+        if format == old_format:
+            return
+
+        cf = self._get_column_family(column_family)
+        col_start, col_end = self._column_range(start, end)
+        key_format = sensor_id + ':' + format
+        if column_family in self.indexes:
+            old_rowkeys = sorted(self._buckets(column_family, [sensor_id],
+                                               start, end))
+            outside = set(self._buckets(column_family, [sensor_id], None,
+                                        None)) - set(old_rowkeys)
+        elif start is None or end is None:
+            raise ValueError("Without an index, start and end are needed")
+        else:
+            old_rowkeys = self._rowkeys(sensor_id, start, end, old_format)
+            # The buckets just before and after the range.
+            delta = bucket_delta(old_format)
+            first = bucket_start(start.astimezone(INTERNAL_TIMEZONE),
+                                 old_format)
+            outside = [
+                stamp.strftime(sensor_id + ':' + old_format)
+                for stamp in (first - delta,
+                              first + delta * len(old_rowkeys))
+            ]
+        outside = [cf.get_count(rowkey) for rowkey in outside]
+        if old_rowkeys:
+            # The parts of the first and last rows outside of the range.
+            if col_start:
+                outside.append(cf.get_count(old_rowkeys[0],
+                                            column_finish=col_start))
+            if col_end:
+                outside.append(cf.get_count(old_rowkeys[-1],
+                                            column_start=col_end))
+        if any(outside):
+            raise ValueError("%s has data outside of the range; rebucket "
+                             "all of it" % sensor_id)
+
+        def copy(remove=False):
+            batch = cf.batch(queue_size=self.queue_size)
+            for rowkey in old_rowkeys:
+                columns = cf.xget(
+                    rowkey,
+                    column_start=col_start,
+                    column_finish=col_end,
+                    buffer_size=page_size
+                )
+                rows = {}
+                names = []
+                for name, value in columns:
+                    stamp = strptime(name.split(COLNAME_SEPERATOR, 1)[0])
+                    key = stamp.strftime(key_format)
+                    rows.setdefault(key, {})[name] = value
+                    names.append(name)
+                    if len(names) >= page_size:
+                        for key, row in rows.items():
+                            mark(key, row)
+                            batch.insert(key, row)
+                        if remove:
+                            batch.remove(rowkey, columns=names)
+                        rows = {}
+                        names = []
+                for key, row in rows.items():
+                    mark(key, row)
+                    batch.insert(key, row)
+                if remove and names:
+                    batch.remove(rowkey, columns=names)
+            if column_family in self.indexes:
+                self._write_index(column_family)
+            batch.send()
+
+        def mark(key, row):
+            if column_family in self.indexes:
+                self._mark_bounds(column_family, sensor_id,
+                                  key.rsplit(':', 1)[1], min(row), max(row))
+
+        copy()
+        register_bucket_format(sensor_id, format)
+        time.sleep(bucket_formats.max_age)
+        copy(remove=delete_old)
+        if delete_old and self.cache is not None:
+            for rowkey in old_rowkeys:
+                self.cache.invalidate(column_family, rowkey)
+        logger.info("Moved %s from %s to %s buckets",
+                    sensor_id, old_format, format)
 
     def truncate(self, column_family):
         self._get_column_family(column_family).truncate()
+        if self.cache is not None:
+            self.cache.clear()
+        if self.latest is not None:
+            self.latest.clear()
+        if column_family in self.indexes:
+            self._get_column_family(self.indexes[column_family]).truncate()
 
     def commit(self, column_family):
-        if column_family in self._batches.keys():
-            self._batches[column_family].send()
-            del self._batches[column_family]
+        """Send the mutations this thread has buffered for column_family."""
+        # The index goes first: a bucket that is indexed but empty is
+        # harmless, one with data that isn't indexed is never read.
+        if column_family in self._local.bounds:
+            self._write_index(column_family)
+        batches = self._local.batches
+        if column_family in batches.keys():
+            timer_start = time.time()
+            batches[column_family].send()
+            del batches[column_family]
+            if self.metrics is not None:
+                self.metrics.observe('commit_seconds',
+                                     time.time() - timer_start,
+                                     column_family=column_family)
+                self.metrics.observe(
+                    'commit_columns',
+                    self._local.buffered.pop(column_family, 0),
+                    column_family=column_family
+                )
+        if self.cache is not None:
+            for rowkey in self._local.pending.pop(column_family, ()):
+                self.cache.invalidate(column_family, rowkey)
+        if column_family in self._local.written:
+            self._update_rollups(column_family)
+
+    def commit_all(self):
+        """Send this thread's buffered mutations for all column families."""
+        for column_family in list(self._local.batches):
+            self.commit(column_family)
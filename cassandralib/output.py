@@ -0,0 +1,96 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+"""Return read results in other forms than a pandas DataFrame.
+
+Reads take an ``output`` argument:
+
+- 'pandas' (the default): a DataFrame indexed by UTC datetimes;
+- 'numpy': a structured numpy array with a 'datetime' field
+  (``datetime64[ns]``, UTC) and a field per key (or '<key>_<aggregate>'
+  with several aggregates);
+- 'dict': a tuple of an int64 array of nanoseconds since the epoch and
+  a dict of column arrays by key;
+- 'arrow': a pyarrow Table with a 'datetime' column (nanoseconds, UTC)
+  and a column per key (named like the 'numpy' fields). Needs pyarrow.
+
+The other forms skip building the DataFrame and localizing its index.
+The 'dict' form is the columns as they are read, without any copy;
+numeric columns are passed to Arrow without a copy as well.
+
+"""
+
+from __future__ import unicode_literals
+
+import numpy as np
+
+OUTPUTS = ('pandas', 'numpy', 'dict', 'arrow')
+
+
+def check_output(output):
+    if output not in OUTPUTS:
+        raise ValueError("output must be one of %s, not %r" %
+                         (', '.join(OUTPUTS), output))
+
+
+def _name(key):
+    # Field names of (key, aggregate) columns of a resampled read are
+    # '<key>_<aggregate>', like in a rollup.
+    if isinstance(key, tuple):
+        return '_'.join('%s' % part for part in key)
+    return str(key)
+
+
+def to_output(datetimes, columns, output):
+    """Return timestamps and columns in the form of ``output``.
+
+    ``datetimes`` is a naive (UTC) ``datetime64[ns]`` array, ``columns``
+    a dict of arrays (or categoricals) by key of the same length. Not
+    for 'pandas'.
+
+    """
+    datetimes = np.asarray(datetimes, dtype='datetime64[ns]')
+    if output in ('numpy', 'dict'):
+        # Categorical columns become arrays of their values.
+        columns = dict((key, np.asarray(column))
+                       for key, column in columns.items())
+    if output == 'dict':
+        return datetimes.view(np.int64), columns
+    if output == 'numpy':
+        dtype = [('datetime', datetimes.dtype)] + [
+            (_name(key), column.dtype) for key, column in columns.items()
+        ]
+        result = np.empty(len(datetimes), dtype=dtype)
+        result['datetime'] = datetimes
+        for key, column in columns.items():
+            result[_name(key)] = column
+        return result
+    if output == 'arrow':
+        import pyarrow as pa
+
+        arrays = [pa.array(datetimes.view(np.int64),
+                           type=pa.timestamp('ns', tz='UTC'))]
+        for column in columns.values():
+            if not isinstance(column, np.ndarray) or column.dtype == object:
+                # pyarrow infers the type (categoricals become dictionary
+                # arrays); missing values are None.
+                arrays.append(pa.array(column, from_pandas=True))
+            else:
+                arrays.append(pa.array(column))
+        return pa.Table.from_arrays(
+            arrays, names=['datetime'] + [_name(key) for key in columns]
+        )
+    check_output(output)
+
+
+def frame_to_output(df, output):
+    """Return a DataFrame indexed by datetimes in the form of ``output``."""
+    if output == 'pandas':
+        return df
+    index = df.index
+    if len(index) == 0:
+        datetimes = np.array([], dtype='datetime64[ns]')
+    else:
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        datetimes = index.values
+    columns = dict((key, df[key].values) for key in df.columns)
+    return to_output(datetimes, columns, output)
@@ -0,0 +1,175 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+"""Decode columns in worker processes (Python 3.8+ only)."""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import os
+import threading
+
+import numpy as np
+
+from cassandralib.models import parse_columns
+
+# Blocks are freed by the process that reads them last. The workers
+# share the resource tracker of the parent (see DecodePool), so a block
+# is tracked once, whichever process created or attached it.
+
+
+def _share(array):
+    # Copy an array into a new shared memory block and describe it.
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    try:
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        return block.name, array.dtype.str, array.shape
+    finally:
+        block.close()
+
+
+def _attach(description, first=None, last=None, free=True):
+    # Copy (a slice of) an array out of a shared memory block.
+    name, dtype, shape = description
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype, buffer=block.buf)[first:last].copy()
+    finally:
+        block.close()
+        if free:
+            block.unlink()
+
+
+def _free(description):
+    _attach(description, 0, 0)
+
+
+def _pack(values):
+    # Numbers, text and binary values are passed through shared memory;
+    # anything else (mixed or missing values) is pickled.
+    if isinstance(values, np.ndarray):
+        if values.dtype != object:
+            return 'array', _share(values)
+        values = values.tolist()
+    types = set(map(type, values))
+    if types == set([str]):
+        return 'text', _share(np.asarray(values))
+    if types == set([bytes]):
+        lengths = np.fromiter(map(len, values), dtype=np.int64,
+                              count=len(values))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        data = np.frombuffer(b''.join(values), dtype=np.uint8)
+        return 'bytes', _share(data), _share(offsets)
+    return 'objects', values
+
+
+def _unpack(packed, first=None, last=None, free=False):
+    if packed[0] in ('array', 'text'):
+        return _attach(packed[1], first, last, free)
+    if packed[0] == 'bytes':
+        offsets = _attach(packed[2], first,
+                          None if last is None else last + 1, free)
+        data = _attach(packed[1], offsets[0], offsets[-1], free)
+        data = data.tobytes()
+        offsets = (offsets - offsets[0]).tolist()
+        return [data[start:end] for start, end in zip(offsets, offsets[1:])]
+    return packed[1][first:last]
+
+
+def _decode(names, values, first, last, keys, codecs, fields):
+    """Parse a part of the columns and decode its values (in a worker).
+
+    Timestamps, rows and values are returned through shared memory,
+    except for values that are neither all numbers, text or bytes.
+
+    """
+    names = _attach(names, first, last, free=False)
+    values = _unpack(values, first, last)
+    datetimes, keys, rows, values = parse_columns(names, values, keys)
+    result = []
+    for key, key_rows, key_values in zip(keys, rows, values):
+        if key in codecs:
+            key_values = codecs[key].decode(key_values)
+        elif key in fields and fields[key].dtype != 'category':
+            key_values = fields[key].convert(key_values)
+        result.append((key, _share(key_rows), _pack(key_values)))
+    return _share(datetimes), result
+
+
+class DecodePool(object):
+    """Parse large reads in ``processes`` worker processes.
+
+    Pass one as ``decoder`` to CassandraDataStore. The columns of reads
+    of at least ``min_columns`` columns are put in shared memory and
+    parsed in a part per process, which also decodes the values of keys
+    with a codec or a (non-category) schema type. The resulting arrays
+    come back through shared memory too, and are merged by timestamp.
+
+    Smaller reads are parsed in the calling process, since handing them
+    over costs more than it saves.
+
+    """
+
+    def __init__(self, processes=None, min_columns=200000):
+        self.processes = processes or os.cpu_count()
+        self.min_columns = min_columns
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Start the tracker before the workers, so they share it.
+                resource_tracker.ensure_running()
+                self._executor = ProcessPoolExecutor(self.processes)
+        return self._executor
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def parse(self, names, values, keys, codecs, fields):
+        """Return like parse_columns(), but with a dict of (rows, values)
+        by key, and the keys whose values have been decoded by a codec."""
+        executor = self._get_executor()
+        shared_names = _share(np.asarray(names))
+        shared_values = _pack(values)
+        bounds = np.linspace(0, len(names), self.processes + 1).astype(int)
+        try:
+            futures = [
+                executor.submit(_decode, shared_names, shared_values,
+                                first, last, keys, codecs, fields)
+                for first, last in zip(bounds[:-1].tolist(),
+                                       bounds[1:].tolist()) if last > first
+            ]
+            parts = [future.result() for future in futures]
+        finally:
+            _free(shared_names)
+            for description in shared_values[1:]:
+                if isinstance(description, tuple):
+                    _free(description)
+
+        # A timestamp may be split over two parts, so renumber the rows
+        # of every part to the unique timestamps of all of them.
+        datetimes = [_attach(part_datetimes) for part_datetimes, _ in parts]
+        offsets = np.cumsum([0] + [len(part) for part in datetimes])
+        datetimes, inverse = np.unique(np.concatenate(datetimes),
+                                       return_inverse=True)
+        collected = {}
+        for offset, (_, part) in zip(offsets, parts):
+            for key, key_rows, key_values in part:
+                kind = key_values[0]
+                key_values = _unpack(key_values, free=True)
+                if kind != 'array':
+                    array = np.empty(len(key_values), dtype=object)
+                    array[:] = key_values
+                    key_values = array
+                rows = inverse[offset + _attach(key_rows)]
+                collected.setdefault(key, []).append((rows, key_values))
+
+        columns = {}
+        for key, pieces in collected.items():
+            rows = np.concatenate([rows for rows, _ in pieces])
+            values = np.concatenate([values for _, values in pieces])
+            columns[key] = (rows, values)
+        return datetimes, columns, set(columns) & set(codecs)
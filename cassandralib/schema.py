@@ -0,0 +1,115 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import numpy as np
+import pandas as pd
+
+TRUE_VALUES = ('True', 'true', '1', b'True', b'true', b'1')
+
+
+def to_float(values):
+    """Convert values (strings, bytes or None) to float64.
+
+    None and values that don't parse become NaN.
+
+    """
+    values = np.array(values, dtype=object)
+    values[pd.isnull(values)] = np.nan
+    try:
+        return values.astype(np.float64)
+    except (TypeError, ValueError):
+        result = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                result[i] = float(value)
+            except (TypeError, ValueError):
+                result[i] = np.nan
+        return result
+
+
+class Field(object):
+    """The type of the values of a key.
+
+    ``dtype`` is a numpy type (float64, int32, bool, ...), 'category' or
+    'datetime64[ns]'. Timestamps without a value, and values that can't
+    be converted, get the ``missing`` value: NaN for floats, -1 for
+    integers, False for booleans and NaN/NaT for categories and datetimes.
+    Categories are the given ``categories``, or those that occur.
+    Datetimes may be in any ISO 8601 form and are converted to UTC; naive
+    ones are taken to be UTC already.
+
+    """
+
+    def __init__(self, dtype, missing=None, categories=None):
+        self.categories = categories
+        if dtype == 'category':
+            self.dtype = dtype
+            return
+        self.dtype = np.dtype(dtype)
+        if missing is None:
+            missing = {
+                'f': np.nan,
+                'i': -1,
+                'u': 0,
+                'b': False,
+                'M': np.datetime64('NaT'),
+            }[self.dtype.kind]
+        self.missing = missing
+
+    def column(self, length, rows, values):
+        """Return a typed array of ``length`` with ``values`` at ``rows``.
+
+        Values are strings or bytes as stored, or numbers decoded by a
+        codec.
+
+        """
+        if self.dtype == 'category':
+            categorical = pd.Categorical(values, categories=self.categories)
+            codes = np.empty(length, dtype=categorical.codes.dtype)
+            codes.fill(-1)
+            codes[rows] = categorical.codes
+            return pd.Categorical.from_codes(
+                codes, categories=categorical.categories
+            )
+        column = np.empty(length, dtype=self.dtype)
+        column.fill(self.missing)
+        column[rows] = self.convert(values)
+        return column
+
+    def convert(self, values):
+        values = np.asarray(values)
+        kind = self.dtype.kind
+        if kind == 'b':
+            if values.dtype.kind == 'b':
+                return values
+            return pd.Series(values).isin(TRUE_VALUES).values
+        if kind == 'M':
+            values = pd.Series(values)
+            stamps = pd.to_datetime(values, errors='coerce', utc=True)
+            # The format is guessed from the first value, so values in
+            # another (ISO) form are parsed one by one.
+            retry = stamps.isnull().values & values.notnull().values
+            if retry.any():
+                stamps[retry] = [
+                    pd.to_datetime(value, errors='coerce', utc=True)
+                    for value in values[retry]
+                ]
+            return stamps.values.astype(self.dtype)
+        if values.dtype.kind in 'fiub':
+            parsed = values
+        else:
+            parsed = to_float(values)
+        if kind in 'iu':
+            invalid = np.isnan(parsed)
+            if invalid.any():
+                parsed = parsed.copy()
+                parsed[invalid] = self.missing
+        return parsed.astype(self.dtype)
+
+
+# The types convert_values_to refers to.
+CONVERSIONS = {
+    'float': Field(np.float32),
+    'integer': Field(np.int32),
+}
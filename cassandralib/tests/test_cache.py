@@ -0,0 +1,123 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from cassandralib import codecs
+from cassandralib import fake
+from cassandralib import models
+from cassandralib.cache import BucketCache
+
+UTC = pytz.UTC
+
+
+class TestBucketCache(unittest.TestCase):
+    start = UTC.localize(datetime(2013, 1, 1))
+    end = UTC.localize(datetime(2013, 1, 2))
+
+    def setUp(self):
+        fake.clear()
+        models.use_bucket_formats(models.BucketFormats())
+        models.register_bucket_format('s1', models.BucketFormat.DAILY)
+        self.cache = BucketCache(10 ** 6)
+        self.store = fake.FakeDataStore([], 'test', 100, cache=self.cache)
+
+    def tearDown(self):
+        models.use_bucket_formats(models.BucketFormats())
+
+    def test_text_and_binary_values(self):
+        # FLOAT32 0.0 and 2.0 encode to ASCII bytes ending with NULs.
+        index = pd.date_range(self.start, periods=3, freq='h')
+        self.store.write_frame('cf', 's1',
+                               pd.DataFrame({'value': [1.5]}, index[:1]))
+        self.store.commit('cf')
+        self.store.set_codec('cf', 'value', codecs.FLOAT32)
+        self.store.write_frame('cf', 's1', pd.DataFrame(
+            {'value': [0.0, 2.0]}, index[1:]
+        ))
+        self.store.commit('cf')
+        for _ in range(2):
+            result = self.store.read('cf', 's1', self.start, self.end)
+            self.assertEqual(list(result['value']), [1.5, 0.0, 2.0])
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_text_values(self):
+        values = self.cache.put('cf', 'row', ['a', 'b'], ['1.5', '2'])[1]
+        self.assertEqual(values.dtype.kind, 'U')
+        values = self.cache.put('cf', 'row', ['a', 'b'],
+                                ['1.5', b'\x00f4\x00\x00\x00\x00'])[1]
+        self.assertEqual(values.dtype, np.dtype(object))
+        self.assertEqual(values[1], b'\x00f4\x00\x00\x00\x00')
+
+
+class Rowkeys(object):
+    # A metrics collector that counts the rowkeys sent to the cluster.
+
+    def __init__(self):
+        self.count = 0
+
+    def observe(self, name, value, **labels):
+        if name == 'read_rowkeys':
+            self.count += value
+
+
+class TestFetch(unittest.TestCase):
+    start = UTC.localize(datetime(2013, 1, 1))
+    end = UTC.localize(datetime(2013, 2, 1))
+
+    def setUp(self):
+        fake.clear()
+        models.use_bucket_formats(models.BucketFormats())
+        models.register_bucket_format('s1', models.BucketFormat.DAILY)
+
+    def tearDown(self):
+        models.use_bucket_formats(models.BucketFormats())
+
+    def store(self, cache):
+        rowkeys = Rowkeys()
+        store = fake.FakeDataStore([], 'test', 100, cache=cache,
+                                   metrics=rowkeys)
+        return store, rowkeys
+
+    def test_empty_buckets_are_cached(self):
+        store, rowkeys = self.store(BucketCache(10 ** 6))
+        index = pd.DatetimeIndex(['2013-01-03', '2013-01-20'], tz=UTC)
+        store.write_frame('cf', 's1', pd.DataFrame({'value': [1, 2]}, index))
+        store.commit('cf')
+        counts = []
+        for _ in range(3):
+            self.assertEqual(len(store.read('cf', 's1', self.start,
+                                            self.end)), 2)
+            counts.append(rowkeys.count)
+            rowkeys.count = 0
+        self.assertEqual(counts, [31, 0, 0])
+
+    def test_spilled_entry_removed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cache = BucketCache(0, directory)
+        cache.put('cf', 'row', ['a'], ['1'])
+        self.assertEqual(len(os.listdir(directory)), 1)
+        original = np.load
+
+        def load(path, **kwargs):
+            # invalidate() removes the file just before it is loaded.
+            cache.invalidate('cf', 'row')
+            return original(path, **kwargs)
+
+        np.load = load
+        try:
+            self.assertIsNone(cache.get('cf', 'row'))
+        finally:
+            np.load = original
+        cache.invalidate('cf', 'row')
+        self.assertEqual(cache.misses, 1)
@@ -0,0 +1,44 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import unittest
+
+import numpy as np
+
+from cassandralib import codecs
+
+
+class TestBinaryCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        for codec in (codecs.FLOAT32, codecs.FLOAT64, codecs.INT32,
+                      codecs.INT64):
+            values = np.array([1, 2, codec.missing, 4])
+            decoded = codec.decode(codec.encode(values) +
+                                   [codec.encode_one(5), '6', None])
+            self.assertEqual(decoded.dtype, codec.dtype)
+            self.assertTrue(np.array_equal(
+                decoded, np.array([1, 2, codec.missing, 4, 5, 6,
+                                   codec.missing], dtype=codec.dtype),
+                equal_nan=codec.dtype.kind == 'f'
+            ))
+
+    def test_header_is_platform_independent(self):
+        self.assertEqual(codecs.INT64.header, b'\x00i8')
+        self.assertEqual(codecs.FLOAT32.header, b'\x00f4')
+
+    def test_text_of_the_same_length(self):
+        # Text values as long as a binary value: 7 characters for 4-byte
+        # types, 11 for 8-byte ones.
+        for codec, text in ((codecs.FLOAT32, '1.23456'),
+                            (codecs.INT32, '1234567'),
+                            (codecs.FLOAT64, '1.234567891'),
+                            (codecs.INT64, '12345678901')):
+            self.assertEqual(len(text), codec.record.itemsize)
+            values = [text, codec.encode_one(2), text.encode('ascii'),
+                      codec.encode_one(3)]
+            decoded = codec.decode(values)
+            expected = np.array([text, 2, text, 3],
+                                dtype=np.float64).astype(codec.dtype)
+            self.assertTrue(np.array_equal(decoded, expected))
@@ -0,0 +1,67 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from cassandralib import fake
+from cassandralib import importer
+from cassandralib import models
+
+# Local times around the DST transitions of Europe/Amsterdam in 2013:
+# 02:00-03:00 is skipped on March 31 and repeated on October 27.
+DST_TIMES = [
+    '2013-03-31 01:30', '2013-03-31 02:30', '2013-03-31 03:30',
+    '2013-10-27 01:30', '2013-10-27 02:00', '2013-10-27 02:30',
+    '2013-10-27 02:00', '2013-10-27 02:30', '2013-10-27 03:00',
+]
+DST_UTC = [
+    '2013-03-31 00:30', '2013-03-31 01:00', '2013-03-31 01:30',
+    '2013-10-26 23:30', '2013-10-27 00:00', '2013-10-27 00:30',
+    '2013-10-27 01:00', '2013-10-27 01:30', '2013-10-27 02:00',
+]
+
+
+class TestImporter(unittest.TestCase):
+
+    def setUp(self):
+        fake.clear()
+        models.use_bucket_formats(models.BucketFormats())
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 's1.csv')
+        pd.DataFrame({
+            'datetime': DST_TIMES,
+            'value': range(len(DST_TIMES)),
+        }).to_csv(self.path, index=False)
+
+    def tearDown(self):
+        models.use_bucket_formats(models.BucketFormats())
+
+    def test_read_file_dst(self):
+        df = importer.read_file(self.path, timezone='Europe/Amsterdam')
+        self.assertEqual(list(df.index.tz_convert('UTC').tz_localize(None)),
+                         list(pd.DatetimeIndex(DST_UTC)))
+
+    def test_run_dst(self):
+        original = importer.CassandraDataStore
+        importer.CassandraDataStore = fake.FakeDataStore
+        self.addCleanup(setattr, importer, 'CassandraDataStore', original)
+        options = {
+            'nodes': [], 'keyspace': 'test', 'column_family': 'cf',
+            'index': 'cf_index', 'bucket_format': None,
+            'time_column': 'datetime', 'timezone': 'Europe/Amsterdam',
+            'sensor_column': 'sensor_id', 'columns': None,
+            'batch_size': 4, 'rate': None, 'checkpoint': None,
+        }
+        rows = importer.run([self.path], options, processes=0,
+                            report=lambda line: None)
+        self.assertEqual(rows, len(DST_TIMES))
+        store = importer._worker['datastore']
+        df = store.read('cf', 's1', None, None, convert_values_to='integer')
+        self.assertEqual(list(df['value']), list(range(len(DST_TIMES))))
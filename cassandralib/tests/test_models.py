@@ -0,0 +1,303 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+from datetime import timedelta
+import unittest
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from cassandralib import codecs
+from cassandralib import fake
+from cassandralib import models
+from cassandralib.aggregate import nanoseconds
+
+UTC = pytz.UTC
+
+
+def frame(periods, freq='97s', start='2012-12-31 20:00'):
+    # A frame with a value and a flag (every 7th is rejected), crossing
+    # the end of a year.
+    index = pd.date_range(start, periods=periods, freq=freq, tz=UTC)
+    return pd.DataFrame({
+        'value': np.arange(periods) % 23 * 1.5,
+        'flag': np.where(np.arange(periods) % 7, '0', '6'),
+    }, index=index)
+
+
+class DataStoreTestCase(unittest.TestCase):
+    start = UTC.localize(datetime(2012, 12, 30))
+    end = UTC.localize(datetime(2013, 1, 10))
+
+    def setUp(self):
+        fake.clear()
+        models.use_bucket_formats(models.BucketFormats())
+        self.store = fake.FakeDataStore([], 'test', 100)
+
+    def tearDown(self):
+        models.use_bucket_formats(models.BucketFormats())
+
+    def write(self, df, sensor_id='s1', column_family='cf'):
+        self.store.write_frame(column_family, sensor_id, df)
+        self.store.commit(column_family)
+
+    def assertFrameEqual(self, df, expected):
+        self.assertEqual(list(df.index), list(expected.index))
+        self.assertEqual(sorted(df.columns), sorted(expected.columns))
+        for column in expected.columns:
+            self.assertEqual(list(df[column]), list(expected[column]))
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_split_column_names(self):
+        names = ['2013-01-01T10:00:00.000001Z_value',
+                 '2013-01-01T10:00:00Z_flag',
+                 'no separator']
+        datetimes, keys, indices = models.split_column_names(names)
+        self.assertEqual(list(indices), [1, 0])
+        self.assertEqual(list(keys), ['flag', 'value'])
+        self.assertEqual(datetimes[0], np.datetime64('2013-01-01T10:00:00'))
+        self.assertEqual(datetimes[1],
+                         np.datetime64('2013-01-01T10:00:00.000001'))
+
+    def test_parse_columns(self):
+        names = ['2013-01-01T10:00:01.000000Z_value',
+                 '2013-01-01T10:00:00.000000Z_value',
+                 '2013-01-01T10:00:01.000000Z_flag']
+        datetimes, keys, rows, values = models.parse_columns(
+            names, ['2', '1', '0']
+        )
+        self.assertEqual(len(datetimes), 2)
+        self.assertEqual(keys, ['flag', 'value'])
+        self.assertEqual(list(rows[0]), [1])
+        self.assertEqual(list(rows[1]), [1, 0])
+        self.assertEqual(list(values[1]), ['2', '1'])
+
+    def test_parse_columns_params(self):
+        names = ['2013-01-01T10:00:00.000000Z_value',
+                 '2013-01-01T10:00:00.000000Z_flag']
+        _, keys, _, values = models.parse_columns(names, ['1', '0'],
+                                                  ['value'])
+        self.assertEqual(keys, ['value'])
+
+
+class TestReadWrite(DataStoreTestCase):
+
+    def test_write_frame_read(self):
+        df = frame(3000)
+        self.write(df)
+        result = self.store.read('cf', 's1', self.start, self.end,
+                                 convert_values_to='float')
+        self.assertEqual(str(result.index.tz), 'UTC')
+        self.assertEqual(list(result.index), list(df.index))
+        self.assertTrue(np.array_equal(result['value'].values,
+                                       df['value'].values))
+        self.assertEqual(list(result['flag']), list(df['flag']))
+
+    def test_write_row_matches_write_frame(self):
+        df = frame(50)
+        self.write(df, 'frame')
+        for timestamp, row in df.iterrows():
+            self.store.write_row('cf', 'row', timestamp.to_pydatetime(),
+                                 dict(row))
+        self.store.commit('cf')
+        self.assertFrameEqual(
+            self.store.read('cf', 'row', self.start, self.end),
+            self.store.read('cf', 'frame', self.start, self.end),
+        )
+
+    def test_ignore_rejected(self):
+        df = frame(100)
+        self.write(df)
+        result = self.store.read('cf', 's1', self.start, self.end,
+                                 ignore_rejected=True)
+        self.assertEqual(list(result.index),
+                         list(df.index[df['flag'] != '6']))
+
+    def test_read_many(self):
+        self.write(frame(100), 's1')
+        self.write(frame(50), 's2')
+        result = self.store.read_many('cf', ['s1', 's2', 's3'],
+                                      self.start, self.end, as_dict=True)
+        self.assertEqual(len(result['s1']), 100)
+        self.assertEqual(len(result['s2']), 50)
+
+    def test_output_dict(self):
+        df = frame(10)
+        self.write(df)
+        stamps, columns = self.store.read('cf', 's1', self.start, self.end,
+                                          output='dict')
+        self.assertEqual(list(stamps), list(nanoseconds(df.index)))
+        self.assertEqual(list(columns['flag']), list(df['flag']))
+
+
+class TestPaging(DataStoreTestCase):
+
+    def test_iter_read_equals_read(self):
+        models.register_bucket_format('s1', models.BucketFormat.DAILY)
+        self.write(frame(3000))
+        expected = self.store.read('cf', 's1', self.start, self.end)
+        pages = list(self.store.iter_read('cf', 's1', self.start, self.end,
+                                          page_size=250))
+        self.assertTrue(len(pages) > 10)
+        for page in pages:
+            # A page is never cut in the middle of a timestamp.
+            self.assertFalse(page['flag'].isnull().any())
+        self.assertFrameEqual(pd.concat(pages), expected)
+
+    def test_iter_read_resample(self):
+        self.write(frame(3000))
+        expected = self.store.read('cf', 's1', self.start, self.end,
+                                   resample='60min', aggregate=['mean', 'max'])
+        pages = list(self.store.iter_read('cf', 's1', self.start, self.end,
+                                          page_size=100, resample='60min',
+                                          aggregate=['mean', 'max']))
+        result = pd.concat([page for page in pages if len(page)])
+        self.assertEqual(list(result.index), list(expected.index))
+        self.assertTrue(np.allclose(result.values, expected.values))
+
+
+class TestFanOut(DataStoreTestCase):
+
+    def test_fan_out_equals_single_request(self):
+        models.register_bucket_format('s1', models.BucketFormat.DAILY)
+        models.register_bucket_format('s2', models.BucketFormat.YEARLY)
+        self.write(frame(3000), 's1')
+        self.write(frame(3000), 's2')
+        fanned = fake.FakeDataStore([], 'test', 100, fan_out=4)
+        for sensor_id in ('s1', 's2'):
+            self.assertFrameEqual(
+                fanned.read('cf', sensor_id, self.start, self.end),
+                self.store.read('cf', sensor_id, self.start, self.end),
+            )
+
+
+class TestCodecs(DataStoreTestCase):
+
+    def test_read_keeps_codec_dtype(self):
+        df = frame(100)
+        self.store.write_frame('cf', 's1', df.iloc[:50])
+        self.store.commit('cf')
+        # Values written as text before the codec are still read.
+        self.store.set_codec('cf', 'value', codecs.FLOAT32)
+        self.write(df.iloc[50:])
+        result = self.store.read('cf', 's1', self.start, self.end)
+        self.assertEqual(result['value'].dtype, np.float32)
+        self.assertTrue(np.array_equal(result['value'].values,
+                                       df['value'].values))
+
+
+class TestIndex(DataStoreTestCase):
+
+    def setUp(self):
+        super(TestIndex, self).setUp()
+        models.register_bucket_format('s1', models.BucketFormat.DAILY)
+        self.store.add_index('cf', 'cf_index')
+
+    def test_open_range(self):
+        df = frame(3000)
+        self.write(df)
+        result = self.store.read('cf', 's1', None, None)
+        self.assertEqual(list(result.index), list(df.index))
+        result = self.store.read('cf', 's1', self.start, None)
+        self.assertEqual(len(result), len(df))
+
+    def test_only_buckets_with_data(self):
+        self.write(frame(10, start='2013-01-01'))
+        self.write(frame(10, start='2013-01-05'))
+        rowkeys = self.store._buckets('cf', ['s1'], self.start, self.end)
+        self.assertEqual(sorted(rowkeys),
+                         ['s1:2013-01-01', 's1:2013-01-05'])
+
+    def test_build_index(self):
+        df = frame(3000)
+        plain = fake.FakeDataStore([], 'test', 100)
+        plain.write_frame('cf', 's1', df)
+        plain.commit('cf')
+        self.assertEqual(len(self.store.read('cf', 's1', None, None)), 0)
+        self.store.build_index('cf', 's1', self.start, self.end)
+        self.assertEqual(len(self.store.read('cf', 's1', None, None)),
+                         len(df))
+
+
+class TestRollups(DataStoreTestCase):
+    aggregate = ['count', 'sum', 'min', 'max', 'mean']
+
+    def check(self, ignore_rejected):
+        raw = fake.FakeDataStore([], 'test', 100)
+        for resample in ('60min', '360min', 'D', '2D'):
+            expected = raw.read('cf', 's1', self.start, self.end,
+                                ignore_rejected=ignore_rejected,
+                                resample=resample, aggregate=self.aggregate)
+            self.assertTrue(self.store._find_rollup(
+                'cf', self.start, self.end, resample, ignore_rejected
+            ))
+            result = self.store.read('cf', 's1', self.start, self.end,
+                                     ignore_rejected=ignore_rejected,
+                                     resample=resample,
+                                     aggregate=self.aggregate)
+            self.assertEqual(list(result.index), list(expected.index))
+            self.assertTrue(np.allclose(result.values.astype(float),
+                                        expected.values.astype(float),
+                                        equal_nan=True))
+
+    def test_incremental_updates(self):
+        df = frame(3000)
+        self.write(df.iloc[:1000])
+        self.store.add_rollup('cf', '60min', 'cf_hourly')
+        self.store.add_rollup('cf', 'D', 'cf_daily')
+        self.store.add_rollup('cf', '60min', 'cf_hourly_accepted', True)
+        self.store.build_rollups('cf', 's1', self.start, self.end)
+        # Appended frames and rows, then an overwrite of older data.
+        self.write(df.iloc[1000:2000])
+        for timestamp, row in df.iloc[2000:].iterrows():
+            self.store.write_row('cf', 's1', timestamp.to_pydatetime(),
+                                 dict(row))
+            if timestamp.minute == 0:
+                self.store.commit('cf')
+        self.store.commit('cf')
+        changed = df.iloc[100:300].copy()
+        changed['value'] += 100
+        self.write(changed)
+        self.check(None)
+        self.check(True)
+
+
+class Rowkeys(object):
+    # A metrics collector that counts the rowkeys read.
+
+    def __init__(self):
+        self.count = 0
+
+    def observe(self, name, value, **labels):
+        if name == 'read_rowkeys':
+            self.count += value
+
+
+class TestReadSince(DataStoreTestCase):
+
+    def test_silent_sensor(self):
+        models.register_bucket_format('s1', models.BucketFormat.DAILY)
+        rowkeys = Rowkeys()
+        store = fake.FakeDataStore([], 'test', 100, metrics=rowkeys)
+        now = datetime.utcnow().replace(tzinfo=UTC)
+        index = pd.DatetimeIndex([now - timedelta(days=9)])
+        self.write(pd.DataFrame({'value': [1.0]}, index))
+        df, cursor = store.read_since('cf', 's1',
+                                      start=now - timedelta(days=10))
+        self.assertEqual(len(df), 1)
+        self.assertEqual(rowkeys.count, 11)
+        for _ in range(3):
+            rowkeys.count = 0
+            df, cursor = store.read_since('cf', 's1', cursor)
+            self.assertEqual(len(df), 0)
+            # Only the buckets that may still get data.
+            self.assertTrue(rowkeys.count <= 2)
+        store.write_row('cf', 's1', now, {'value': 2.0})
+        store.commit('cf')
+        df, cursor = store.read_since('cf', 's1', cursor)
+        self.assertEqual(list(df['value']), ['2.0'])
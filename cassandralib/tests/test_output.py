@@ -0,0 +1,53 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+import unittest
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from cassandralib import fake
+from cassandralib import models
+
+UTC = pytz.UTC
+
+
+class TestOutput(unittest.TestCase):
+    start = UTC.localize(datetime(2013, 1, 1))
+    end = UTC.localize(datetime(2013, 1, 2))
+
+    def setUp(self):
+        fake.clear()
+        models.use_bucket_formats(models.BucketFormats())
+        self.store = fake.FakeDataStore([], 'test', 100)
+        index = pd.date_range(self.start, periods=48, freq='30min')
+        self.store.write_frame('cf', 's1', pd.DataFrame(
+            {'value': np.arange(48.)}, index
+        ))
+        self.store.commit('cf')
+
+    def read(self, output):
+        return self.store.read('cf', 's1', self.start, self.end,
+                               resample='60min', aggregate=['mean', 'max'],
+                               output=output)
+
+    def test_numpy_aggregate_names(self):
+        result = self.read('numpy')
+        self.assertEqual(sorted(result.dtype.names),
+                         ['datetime', 'value_max', 'value_mean'])
+        self.assertEqual(list(result['value_max'][:2]), [1., 3.])
+        self.assertEqual(list(result['value_mean'][:2]), [.5, 2.5])
+
+    def test_arrow_aggregate_names(self):
+        try:
+            import pyarrow  # noqa
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        result = self.read('arrow')
+        self.assertEqual(sorted(result.column_names),
+                         ['datetime', 'value_max', 'value_mean'])
+        self.assertEqual(result.column('value_max').to_pylist()[:2],
+                         [1., 3.])
@@ -0,0 +1,24 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import unittest
+
+import numpy as np
+
+from cassandralib.schema import Field
+
+
+class TestField(unittest.TestCase):
+
+    def test_datetimes_in_mixed_iso_forms(self):
+        field = Field('datetime64[ns]')
+        values = ['2013-01-01T00:00:00Z', '2013-02-01',
+                  '2013-03-01 12:30', '2013-04-01T02:00:00+02:00',
+                  'not a date']
+        column = field.column(6, [0, 1, 2, 3, 5], values)
+        expected = np.array(['2013-01-01T00:00', '2013-02-01T00:00',
+                             '2013-03-01T12:30', '2013-04-01T00:00',
+                             'NaT', 'NaT'], dtype='datetime64[ns]')
+        self.assertEqual(column.dtype, np.dtype('datetime64[ns]'))
+        self.assertTrue(np.array_equal(column, expected, equal_nan=True))
@@ -0,0 +1,138 @@
+# (c) Nelen & Schuurmans.  MIT licensed, see LICENSE.rst.
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+_FLUSH = object()
+_STOP = object()
+
+
+class WriterError(Exception):
+    pass
+
+
+class BackgroundWriter(object):
+    """Buffer writes to a CassandraDataStore and send them from a thread.
+
+    Any number of threads may call write_row() and write_frame(); the
+    writes are queued and applied by a single background thread, which
+    sends its batches once ``flush_size`` writes have been buffered or
+    ``flush_interval`` seconds have passed since the last flush. When
+    more than ``max_queue`` writes are waiting, callers block until there
+    is room again (or raise queue.Full after ``timeout`` seconds).
+
+    close() (or leaving the writer as a context manager) waits until all
+    queued writes have been sent. If sending failed, the error is raised
+    as a WriterError from the next call.
+
+    """
+
+    def __init__(self, store, flush_size=1000, flush_interval=1.0,
+                 max_queue=10000, timeout=None):
+        self.store = store
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='cassandralib-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise WriterError("Writing to Cassandra failed: %s" % error)
+        if self._closed:
+            raise WriterError("Writer is closed")
+
+    def _put(self, item):
+        self._check()
+        self._queue.put(item, timeout=self.timeout)
+
+    def write_row(self, column_family, sensor_id, timestamp, row):
+        self._put(('write_row', (column_family, sensor_id, timestamp, row)))
+
+    def write_frame(self, column_family, sensor_id, df):
+        self._put(('write_frame', (column_family, sensor_id, df)))
+
+    def flush(self):
+        """Block until everything written so far has been sent."""
+        done = threading.Event()
+        self._put((_FLUSH, done))
+        done.wait()
+        self._check()
+
+    def close(self):
+        if self._closed:
+            return
+        self._queue.put((_STOP, None))
+        self._thread.join()
+        self._closed = True
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise WriterError("Writing to Cassandra failed: %s" % error)
+
+    def _send(self):
+        timer_start = time.time()
+        try:
+            self.store.commit_all()
+        except Exception as e:
+            logger.exception("Flushing writes failed")
+            self._error = e
+        elapsed = time.time() - timer_start
+        logger.debug("flushed in %.3fs", elapsed)
+        if self.store.metrics is not None:
+            self.store.metrics.observe('writer_flush_seconds', elapsed)
+
+    def _run(self):
+        buffered = 0
+        last_flush = time.time()
+        while True:
+            wait = max(0, last_flush + self.flush_interval - time.time())
+            try:
+                method, args = self._queue.get(timeout=wait)
+            except queue.Empty:
+                method, args = None, None
+
+            if method is _STOP:
+                self._send()
+                return
+            if method is _FLUSH:
+                self._send()
+                buffered = 0
+                last_flush = time.time()
+                args.set()
+                continue
+            if method is not None:
+                try:
+                    getattr(self.store, method)(*args)
+                    buffered += 1
+                except Exception as e:
+                    logger.exception("Buffering a write failed")
+                    self._error = e
+
+            if buffered >= self.flush_size or \
+                    time.time() - last_flush >= self.flush_interval:
+                if buffered:
+                    self._send()
+                buffered = 0
+                last_flush = time.time()
@@ -9,6 +9,7 @@ long_description = '\n\n'.join([
     ])
 
 install_requires = [
+    'futures; python_version < "3"',
     'numpy',
     'pandas',
     'pycassa',
@@ -24,7 +25,10 @@ setup(name='cassandralib',
       description="Python library to talk to Cassandra",
       long_description=long_description,
       # Get strings from http://www.python.org/pypi?%3Aaction=list_classifiers
-      classifiers=['Programming Language :: Python'],
+      classifiers=['Programming Language :: Python',
+                   'Programming Language :: Python :: 2',
+                   'Programming Language :: Python :: 2.7',
+                   'Programming Language :: Python :: 3'],
       keywords=[],
       author='Berto Booijink',
       author_email='berto.booijink@nelen-schuurmans.nl',
@@ -33,10 +37,14 @@ setup(name='cassandralib',
       packages=['cassandralib'],
       include_package_data=True,
       zip_safe=False,
+      # cassandralib.aio needs Python 3.5+, cassandralib.parallel 3.8+.
+      python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*',
       install_requires=install_requires,
       tests_require=tests_require,
-      extras_require={'test': tests_require},
+      extras_require={'test': tests_require, 'arrow': ['pyarrow']},
       entry_points={
           'console_scripts': [
+              'cassandralib-benchmark = cassandralib.benchmark:main',
+              'cassandralib-import = cassandralib.importer:main',
           ]},
       )